@@ -0,0 +1,80 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.http import HttpResponse
+
+from .views import IngredientViewSet, RecipeViewSet, TagViewsSet
+
+_executor = None
+_executor_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.ASYNC_DB_WORKERS,
+                    thread_name_prefix='async-db',
+                )
+    return _executor
+
+
+def call_with_connection(func, *args, **kwargs):
+    close_old_connections()
+    if (
+        connection.connection is not None
+        and time.monotonic() - getattr(_local, 'used_at', 0)
+        > settings.ASYNC_DB_PING_INTERVAL
+        and not connection.is_usable()
+    ):
+        connection.close()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _local.used_at = time.monotonic()
+        close_old_connections()
+
+
+async def run(func, *args, **kwargs):
+    return await sync_to_async(
+        call_with_connection, thread_sensitive=False, executor=get_executor()
+    )(func, *args, **kwargs)
+
+
+def as_async_view(viewset, actions, endpoint):
+    view = viewset.as_view(actions)
+
+    def handle(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        request.view_finished = time.perf_counter()
+        response.render()
+        rendered = HttpResponse(response.content, status=response.status_code)
+        for header, value in response.items():
+            rendered[header] = value
+        return rendered
+
+    async def async_view(request, *args, **kwargs):
+        return await run(handle, request, *args, **kwargs)
+
+    async_view.endpoint = endpoint
+    async_view.csrf_exempt = True
+    return async_view
+
+
+recipe_list = as_async_view(
+    RecipeViewSet, {'get': 'list'}, 'async.recipe_list'
+)
+recipe_detail = as_async_view(
+    RecipeViewSet, {'get': 'retrieve'}, 'async.recipe_detail'
+)
+ingredient_list = as_async_view(
+    IngredientViewSet, {'get': 'list'}, 'async.ingredient_list'
+)
+tag_list = as_async_view(TagViewsSet, {'get': 'list'}, 'async.tag_list')
@@ -0,0 +1,136 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from users.models import User
+
+from .cache import is_shared_cache
+
+SNAPSHOT_EXCLUDE = {'password'}
+
+
+def get_cache_key(key):
+    return f'auth_token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def make_snapshot(user):
+    return {
+        field.attname: getattr(user, field.attname)
+        for field in User._meta.concrete_fields
+        if field.attname not in SNAPSHOT_EXCLUDE
+    }
+
+
+def restore_user(snapshot):
+    return User.from_db(
+        DEFAULT_DB_ALIAS, list(snapshot), list(snapshot.values())
+    )
+
+
+class TokenCache:
+    counters = ('local_hits', 'shared_hits', 'misses', 'invalidations')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._stats = dict.fromkeys(self.counters, 0)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _remember(self, key, snapshot):
+        with self._lock:
+            self._data[key] = (
+                time.monotonic() + settings.AUTH_TOKEN_LOCAL_TTL, snapshot
+            )
+            self._data.move_to_end(key)
+            while len(self._data) > settings.AUTH_TOKEN_LOCAL_CACHE_SIZE:
+                self._data.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            expires, snapshot = self._data.get(key, (0, None))
+            if snapshot is not None and expires > time.monotonic():
+                self._data.move_to_end(key)
+                self._stats['local_hits'] += 1
+                return snapshot
+            self._data.pop(key, None)
+        snapshot = cache.get(get_cache_key(key))
+        if snapshot is None:
+            self._count('misses')
+            return None
+        self._count('shared_hits')
+        self._remember(key, snapshot)
+        return snapshot
+
+    def set(self, key, snapshot):
+        cache.set(
+            get_cache_key(key), snapshot, settings.AUTH_TOKEN_CACHE_TIMEOUT
+        )
+        self._remember(key, snapshot)
+
+    def invalidate(self, key):
+        def forget():
+            cache.delete(get_cache_key(key))
+            with self._lock:
+                self._data.pop(key, None)
+                self._stats['invalidations'] += 1
+        transaction.on_commit(forget)
+
+    def invalidate_user(self, user_id):
+        self.invalidate_users([user_id])
+
+    def invalidate_users(self, user_ids):
+        for key in Token.objects.filter(user_id__in=user_ids).values_list(
+            'key', flat=True
+        ):
+            self.invalidate(key)
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self._stats)
+            size = len(self._data)
+        lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+        return {
+            **stats,
+            'local_size': size,
+            'hit_ratio': round(
+                (stats['local_hits'] + stats['shared_hits']) / lookups, 3
+            ) if lookups else None,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._stats = dict.fromkeys(self.counters, 0)
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+    def authenticate_credentials(self, key):
+        if not is_shared_cache():
+            return super().authenticate_credentials(key)
+        snapshot = token_cache.get(key)
+        if snapshot is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, make_snapshot(user))
+            return user, token
+        user = restore_user(snapshot)
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                'Пользователь неактивен или удалён.'
+            )
+        token = Token(key=key, user_id=user.pk)
+        token.user = user
+        return user, token
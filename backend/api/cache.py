@@ -0,0 +1,30 @@
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'version:{}'
+LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_shared_cache():
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_BACKENDS
+
+
+def get_version(name):
+    key = VERSION_KEY.format(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    transaction.on_commit(
+        lambda: cache.set(VERSION_KEY.format(name), uuid4().hex, None)
+    )
@@ -0,0 +1,15 @@
+from django.core.checks import Tags, Warning, register
+
+from .cache import is_shared_cache
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    if is_shared_cache():
+        return []
+    return [Warning(
+        'Кэш по умолчанию живёт внутри одного процесса: сброс версий '
+        'кэша и токенов не дойдёт до остальных воркеров gunicorn.',
+        hint='Задайте REDIS_URL.',
+        id='api.W001',
+    )]
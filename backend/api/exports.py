@@ -0,0 +1,130 @@
+import csv
+import logging
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFError, TTFont
+from reportlab.pdfgen import canvas
+
+from .cache import get_version
+from .services import get_shopping_list, normalize_shopping_list
+
+logger = logging.getLogger(__name__)
+
+TITLE = 'Cписок покупок:'
+FILENAME = 'shop_list'
+
+PAGE_MARGIN = 48
+FONT_SIZE = 12
+LINE_HEIGHT = 18
+
+
+def export_txt(items):
+    yield f'{TITLE}\n'.encode()
+    for name, amount, measurement_unit in items:
+        yield f'{name} - {amount}{measurement_unit}\n'.encode()
+
+
+class Echo:
+
+    def write(self, value):
+        return value
+
+
+def export_csv(items):
+    writer = csv.writer(Echo())
+    yield '\ufeff'.encode()
+    yield writer.writerow(('Ингредиент', 'Количество', 'Единица')).encode()
+    for item in items:
+        yield writer.writerow(item).encode()
+
+
+FONT_NAME = 'ShoppingList'
+FALLBACK_FONT = 'Helvetica'
+
+
+def get_font():
+    if FONT_NAME in pdfmetrics.getRegisteredFontNames():
+        return FONT_NAME
+    try:
+        pdfmetrics.registerFont(
+            TTFont(FONT_NAME, settings.SHOPPING_LIST_FONT)
+        )
+    except TTFError:
+        logger.warning(
+            'Шрифт %s не найден, кириллица в PDF может не отображаться.',
+            settings.SHOPPING_LIST_FONT,
+        )
+        return FALLBACK_FONT
+    return FONT_NAME
+
+
+def export_pdf(items):
+    buffer = BytesIO()
+    document = canvas.Canvas(buffer, pagesize=A4)
+    document.setTitle(TITLE.rstrip(':'))
+    width, height = A4
+    font = get_font()
+    lines = [TITLE, ''] + [
+        f'{name} — {amount} {measurement_unit}'
+        for name, amount, measurement_unit in items
+    ]
+    top = height - PAGE_MARGIN
+    y = top
+    for line in lines:
+        if y < PAGE_MARGIN:
+            document.showPage()
+            y = top
+        document.setFont(font, FONT_SIZE)
+        document.drawString(PAGE_MARGIN, y, line)
+        y -= LINE_HEIGHT
+    document.save()
+    yield buffer.getvalue()
+
+
+EXPORTERS = {
+    'txt': (export_txt, 'text/plain; charset=utf-8'),
+    'csv': (export_csv, 'text/csv; charset=utf-8'),
+    'pdf': (export_pdf, 'application/pdf'),
+}
+
+
+def cache_chunks(key, chunks):
+    parts = []
+    size = 0
+    for chunk in chunks:
+        yield chunk
+        if parts is not None:
+            size += len(chunk)
+            if size > settings.SHOPPING_LIST_CACHE_MAX_SIZE:
+                parts = None
+            else:
+                parts.append(chunk)
+    if parts is not None:
+        cache.set(
+            key, b''.join(parts), settings.SHOPPING_LIST_CACHE_TIMEOUT
+        )
+
+
+def export_shopping_list(user, export_format):
+    exporter, content_type = EXPORTERS[export_format]
+    key = (
+        f'shopping_list:{user.id}:{export_format}:'
+        f'{get_version(f"user:{user.id}")}:{get_version("recipes")}'
+    )
+    content = cache.get(key)
+    if content is not None:
+        response = HttpResponse(content, content_type=content_type)
+    else:
+        items = normalize_shopping_list(get_shopping_list(user))
+        response = StreamingHttpResponse(
+            cache_chunks(key, exporter(items)), content_type=content_type
+        )
+    response['Content-Disposition'] = (
+        f'attachment; filename={FILENAME}.{export_format}'
+    )
+    return response
@@ -0,0 +1,42 @@
+import base64
+import binascii
+from uuid import uuid4
+
+import filetype
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from drf_extra_fields.fields import Base64FieldMixin, Base64ImageField
+from rest_framework.exceptions import ValidationError
+
+BASE64_HEADER = ';base64,'
+CHUNK_SIZE = 64 * 1024
+
+
+class StreamingBase64ImageField(Base64ImageField):
+
+    def to_internal_value(self, base64_data):
+        if base64_data in self.EMPTY_VALUES:
+            return None
+        if not isinstance(base64_data, str):
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+        start = base64_data.find(BASE64_HEADER)
+        start = 0 if start == -1 else start + len(BASE64_HEADER)
+        file = TemporaryUploadedFile(str(uuid4()), None, 0, None)
+        try:
+            for position in range(start, len(base64_data), CHUNK_SIZE):
+                file.write(base64.b64decode(
+                    base64_data[position:position + CHUNK_SIZE]
+                ))
+            file.size = file.tell()
+            file.seek(0)
+            extension = filetype.guess_extension(file.read(8192))
+            file.seek(0)
+        except (binascii.Error, ValueError):
+            file.close()
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+        if extension == 'jpeg':
+            extension = 'jpg'
+        if extension not in self.ALLOWED_TYPES:
+            file.close()
+            raise ValidationError(self.INVALID_TYPE_MESSAGE)
+        file.name = f'{file.name}.{extension}'
+        return super(Base64FieldMixin, self).to_internal_value(file)
@@ -2,6 +2,10 @@ from django_filters import rest_framework as filters
 
 from recipes.models import Recipe
 
+from .search import search_recipes
+
+POPULAR_ORDERING = ('-favorites_count', '-pub_date', '-id')
+
 
 class RecipesFilter(filters.FilterSet):
     tags = filters.CharFilter(method='filter_tags')
@@ -12,10 +16,15 @@ class RecipesFilter(filters.FilterSet):
     author = filters.NumberFilter(
         method='filter_author'
     )
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.CharFilter(method='filter_ordering')
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+        fields = (
+            'tags', 'author', 'is_favorited', 'is_in_shopping_cart',
+            'search', 'ordering',
+        )
 
     def is_favorited_filter(self, queryset, name, value):
         user = self.request.user
@@ -43,3 +52,13 @@ class RecipesFilter(filters.FilterSet):
     def filter_tags(self, queryset, name, value):
         tags = self.request.GET.getlist('tags')
         return queryset.filter(tags__slug__in=tags).distinct()
+
+    def filter_search(self, queryset, name, value):
+        if not value.strip():
+            return queryset
+        return search_recipes(queryset, value)
+
+    def filter_ordering(self, queryset, name, value):
+        if value == 'popular':
+            return queryset.order_by(*POPULAR_ORDERING)
+        return queryset
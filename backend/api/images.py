@@ -0,0 +1,107 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from recipes.models import Recipe
+
+from .cache import bump_version
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.IMAGE_WORKERS,
+                    thread_name_prefix='image-variants',
+                )
+    return _executor
+
+
+def get_variant_name(name, variant):
+    path = PurePosixPath(name)
+    return str(path.parent / 'variants' / f'{path.stem}_{variant}.webp')
+
+
+def get_variant_urls(variants, request=None):
+    urls = {}
+    for variant, name in variants.items():
+        url = default_storage.url(name)
+        urls[variant] = request.build_absolute_uri(url) if request else url
+    return urls
+
+
+def save_variants(name):
+    with default_storage.open(name) as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    variants = {}
+    for variant, size in settings.RECIPE_IMAGE_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail(size)
+        buffer = BytesIO()
+        resized.save(buffer, 'WEBP', quality=settings.IMAGE_WEBP_QUALITY)
+        variant_name = get_variant_name(name, variant)
+        default_storage.delete(variant_name)
+        variants[variant] = default_storage.save(
+            variant_name, ContentFile(buffer.getvalue())
+        )
+    return variants
+
+
+def generate_variants(name):
+    variants = save_variants(name)
+    if Recipe.objects.filter(image=name).update(image_variants=variants):
+        bump_version('recipes')
+    else:
+        for variant_name in variants.values():
+            default_storage.delete(variant_name)
+    return variants
+
+
+def delete_image(name, variants):
+    if Recipe.objects.filter(image=name).exists():
+        return
+    for file_name in (name, *variants.values()):
+        default_storage.delete(file_name)
+
+
+def run_in_background(func, *args):
+    close_old_connections()
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Ошибка при обработке картинки %s', args[0])
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(name):
+    transaction.on_commit(
+        lambda: get_executor().submit(
+            run_in_background, generate_variants, name
+        )
+    )
+
+
+def schedule_delete_image(name, variants):
+    if name:
+        transaction.on_commit(
+            lambda: get_executor().submit(
+                run_in_background, delete_image, name, variants
+            )
+        )
@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from rest_framework.serializers import BaseSerializer
+
+logger = logging.getLogger(__name__)
+
+current_counter = ContextVar('current_counter', default=None)
+serializing = ContextVar('serializing', default=False)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.serialize_duration = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            with self._lock:
+                self.duration += duration
+                self.count += 1
+
+    def add_serialize_time(self, duration):
+        with self._lock:
+            self.serialize_duration += duration
+
+
+def count_queries(execute, sql, params, many, context):
+    counter = current_counter.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    return counter(execute, sql, params, many, context)
+
+
+def time_serializer_data(get_data):
+    @wraps(get_data)
+    def wrapper(serializer):
+        counter = current_counter.get()
+        if counter is None or serializing.get():
+            return get_data(serializer)
+        token = serializing.set(True)
+        started = time.perf_counter()
+        try:
+            return get_data(serializer)
+        finally:
+            serializing.reset(token)
+            counter.add_serialize_time(time.perf_counter() - started)
+    wrapper.timed = True
+    return wrapper
+
+
+def install_serializer_timer():
+    if not getattr(BaseSerializer.data.fget, 'timed', False):
+        BaseSerializer.data = property(
+            time_serializer_data(BaseSerializer.data.fget)
+        )
+
+
+class EndpointStats:
+    fields = (
+        'queries', 'db_time', 'view_time', 'serialize_time', 'render_time',
+        'size',
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def record(self, endpoint, **values):
+        with self._lock:
+            stats = self._data.setdefault(endpoint, {
+                'requests': 0,
+                'budget_exceeded': 0,
+                **{f'total_{field}': 0 for field in self.fields},
+                **{f'max_{field}': 0 for field in self.fields},
+            })
+            stats['requests'] += 1
+            stats['budget_exceeded'] += values.pop('budget_exceeded')
+            for field, value in values.items():
+                stats[f'total_{field}'] += value
+                stats[f'max_{field}'] = max(stats[f'max_{field}'], value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                endpoint: {
+                    'requests': stats['requests'],
+                    'budget_exceeded': stats['budget_exceeded'],
+                    'budget': settings.QUERY_BUDGETS.get(endpoint),
+                    **{
+                        f'avg_{field}': round(
+                            stats[f'total_{field}'] / stats['requests'], 3
+                        )
+                        for field in self.fields
+                    },
+                    **{
+                        f'max_{field}': round(stats[f'max_{field}'], 3)
+                        for field in self.fields
+                    },
+                }
+                for endpoint, stats in self._data.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._data.clear()
+
+
+endpoint_stats = EndpointStats()
+
+
+def get_endpoint(view_func, method):
+    endpoint = getattr(view_func, 'endpoint', None)
+    if endpoint is not None:
+        return endpoint
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return None
+    actions = getattr(view_func, 'actions', None) or {}
+    return f'{view_class.__name__}.{actions.get(method, method)}'
+
+
+def check_query_budget(endpoint, queries):
+    budget = settings.QUERY_BUDGETS.get(endpoint)
+    if budget is None or queries <= budget:
+        return False
+    message = f'{endpoint}: {queries} SQL-запросов при бюджете {budget}'
+    if settings.QUERY_BUDGET_STRICT:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+    return True
+
+
+class QueryBudgetMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        counter = QueryCounter()
+        token = current_counter.set(counter)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_counter.reset(token)
+        return self.finish(request, response, counter, started)
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        token = current_counter.set(counter)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_counter.reset(token)
+        return self.finish(request, response, counter, started)
+
+    def finish(self, request, response, counter, started):
+        finished = time.perf_counter()
+        match = getattr(request, 'resolver_match', None)
+        endpoint = match and get_endpoint(match.func, request.method.lower())
+        if endpoint is None:
+            return response
+        view_finished = getattr(request, 'view_finished', finished)
+        timings = {
+            'queries': counter.count,
+            'db_time': counter.duration * 1000,
+            'view_time': (
+                view_finished - started - counter.serialize_duration
+            ) * 1000,
+            'serialize_time': counter.serialize_duration * 1000,
+            'render_time': (finished - view_finished) * 1000,
+            'size': 0 if response.streaming else len(response.content),
+        }
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={timings["db_time"]:.2f};'
+            f'desc="{counter.count} queries"',
+            f'view;dur={timings["view_time"]:.2f}',
+            f'serialize;dur={timings["serialize_time"]:.2f}',
+            f'render;dur={timings["render_time"]:.2f}',
+            f'total;dur={(finished - started) * 1000:.2f}',
+        ))
+        endpoint_stats.record(
+            endpoint,
+            budget_exceeded=check_query_budget(endpoint, counter.count),
+            **timings,
+        )
+        return response
+
+    def process_template_response(self, request, response):
+        request.view_finished = time.perf_counter()
+        return response
@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_cache_control
+from rest_framework import serializers, status
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
+
+from .cache import get_version
+from .services import add_relations, remove_relations
+
+
+class VersionedCacheMixin:
+    cache_version_name = None
+
+    def get_etag(self, request):
+        return '"{}-{}-{}"'.format(
+            self.cache_version_name,
+            get_version(self.cache_version_name),
+            request.accepted_renderer.format,
+        )
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        etag = self.get_etag(request)
+        if etag in request.headers.get('If-None-Match', ''):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            key = f'response:{etag}:{request.get_full_path()}'
+            data = cache.get(key)
+            if data is None:
+                data = handler(request, *args, **kwargs).data
+                cache.set(key, data, settings.REFERENCE_CACHE_TIMEOUT)
+            response = Response(data)
+        response['ETag'] = etag
+        patch_cache_control(
+            response, public=True, max_age=settings.REFERENCE_CACHE_MAX_AGE
+        )
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, super().retrieve, *args, **kwargs
+        )
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=settings.BULK_MAX_ITEMS,
+    )
+
+
+class RelationMixin:
+    relation_errors = {}
+
+    def raise_relation_error(self, model, result):
+        error_status, message = self.relation_errors[model][result]
+        if error_status == status.HTTP_404_NOT_FOUND:
+            raise NotFound(message)
+        raise ValidationError({'errors': message})
+
+    def get_relation_id(self, pk):
+        try:
+            return int(pk)
+        except ValueError:
+            raise ValidationError('ID не должно быть строкой')
+
+    def add_relation(self, model, pk, serializer_class):
+        pk = self.get_relation_id(pk)
+        results, targets = add_relations(model, self.request.user, [pk])
+        if results[pk] != 'created':
+            self.raise_relation_error(model, results[pk])
+        serializer = serializer_class(
+            targets[pk], context=self.get_serializer_context()
+        )
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def remove_relation(self, model, pk):
+        pk = self.get_relation_id(pk)
+        results = remove_relations(model, self.request.user, [pk])
+        if results[pk] != 'deleted':
+            self.raise_relation_error(model, results[pk])
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def bulk_relations(self, model):
+        serializer = BulkIdsSerializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        if self.request.method == 'POST':
+            results, _ = add_relations(model, self.request.user, ids)
+        else:
+            results = remove_relations(model, self.request.user, ids)
+        return Response({'results': [
+            {'id': pk, 'status': result} for pk, result in results.items()
+        ]})
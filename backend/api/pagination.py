@@ -1,5 +1,191 @@
+import base64
+import datetime
+import json
+from collections import OrderedDict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class CursorEncoder(DjangoJSONEncoder):
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(
+        json.dumps(values, cls=CursorEncoder).encode()
+    ).decode()
+
+
+def parse_cursor_datetime(value):
+    value = parse_datetime(value)
+    if value is None or timezone.is_naive(value):
+        raise ValueError(value)
+    return value
+
+
+def parse_cursor_int(value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise TypeError(value)
+    if not -2 ** 63 <= value < 2 ** 63:
+        raise ValueError(value)
+    return value
+
+
+CURSOR_FIELDS = {
+    'pub_date': parse_cursor_datetime,
+    'date_subscriptions': parse_cursor_datetime,
+    'id': parse_cursor_int,
+    'recipe_id': parse_cursor_int,
+    'favorites_count': parse_cursor_int,
+}
+
+
+def decode_cursor(cursor, ordering):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise ValueError(values)
+        return [
+            CURSOR_FIELDS[field.lstrip('-')](value)
+            for field, value in zip(ordering, values)
+        ]
+    except (TypeError, ValueError):
+        raise NotFound('Неверный курсор.')
+
+
+def get_position_filter(ordering, values):
+    first = ordering[0]
+    lookup = 'lte' if first.startswith('-') else 'gte'
+    bound = Q(**{f'{first.lstrip("-")}__{lookup}': values[0]})
+    position = Q()
+    for index, field in enumerate(ordering):
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition = Q(**{f'{field.lstrip("-")}__{lookup}': values[index]})
+        for previous, value in zip(ordering[:index], values):
+            condition &= Q(**{previous.lstrip('-'): value})
+        position |= condition
+    return bound & position
 
 
 class CustomPaginator(PageNumberPagination):
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    skip_count_query_param = 'skip_count'
+
+    def get_cursor_ordering(self, view):
+        if view is None:
+            return None
+        return getattr(view, 'cursor_ordering', {}).get(view.action)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_cursor_ordering(view)
+        self.skip_count = request.query_params.get(
+            self.skip_count_query_param
+        ) in ('1', 'true')
+        self.use_cursor = bool(
+            self.ordering
+            and self.cursor_query_param in request.query_params
+        )
+        if self.use_cursor:
+            return self.paginate_by_cursor(queryset, request)
+        if self.skip_count:
+            return self.paginate_without_count(queryset, request)
+        return super().paginate_queryset(queryset, request, view)
+
+    def paginate_by_cursor(self, queryset, request):
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        self.count = None if self.skip_count else queryset.count()
+        cursor = request.query_params[self.cursor_query_param]
+        if cursor:
+            queryset = queryset.filter(get_position_filter(
+                self.ordering, decode_cursor(cursor, self.ordering)
+            ))
+        rows = list(queryset[:page_size + 1])
+        self.next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            self.next_cursor = encode_cursor([
+                getattr(rows[-1], field.lstrip('-'))
+                for field in self.ordering
+            ])
+        return rows
+
+    def paginate_by_key(self, request, fetch, ordering, key=list):
+        self.request = request
+        self.use_cursor = True
+        self.count = None
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        rows = fetch(cursor and decode_cursor(cursor, ordering), page_size)
+        self.next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            self.next_cursor = encode_cursor(key(rows[-1]))
+        return rows
+
+    def paginate_without_count(self, queryset, request):
+        page_size = self.get_page_size(request)
+        try:
+            self.page_number = int(
+                request.query_params.get(self.page_query_param, 1)
+            )
+        except ValueError:
+            raise NotFound(self.invalid_page_message)
+        if self.page_number < 1:
+            raise NotFound(self.invalid_page_message)
+        offset = (self.page_number - 1) * page_size
+        rows = list(queryset[offset:offset + page_size + 1])
+        self.has_next = len(rows) > page_size
+        return rows[:page_size]
+
+    def get_next_link(self):
+        url = self.request.build_absolute_uri()
+        if self.use_cursor:
+            if self.next_cursor is None:
+                return None
+            return replace_query_param(
+                url, self.cursor_query_param, self.next_cursor
+            )
+        if self.skip_count:
+            if not self.has_next:
+                return None
+            return replace_query_param(
+                url, self.page_query_param, self.page_number + 1
+            )
+        return super().get_next_link()
+
+    def get_previous_link(self):
+        if self.use_cursor:
+            return None
+        if self.skip_count:
+            if self.page_number == 1:
+                return None
+            return replace_query_param(
+                self.request.build_absolute_uri(),
+                self.page_query_param,
+                self.page_number - 1,
+            )
+        return super().get_previous_link()
+
+    def get_paginated_response(self, data):
+        if not (self.use_cursor or self.skip_count):
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', getattr(self, 'count', None)),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
@@ -0,0 +1,184 @@
+import logging
+import threading
+import time
+from array import array
+from collections import Counter, defaultdict
+from itertools import chain
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Q
+
+from recipes.models import Recipe, RecipeIngredient
+
+CHUNK_SIZE = 10000
+
+logger = logging.getLogger(__name__)
+
+
+def build_index(rows, size):
+    postings = defaultdict(lambda: array('l'))
+    totals = array('H', bytes(2 * (size + 1)))
+    for recipe_id, ingredient_id in rows:
+        postings[ingredient_id].append(recipe_id)
+        totals[recipe_id] += 1
+    return dict(postings), totals
+
+
+def rank_matches(postings, totals, overlay, ingredient_ids, max_missing):
+    pantry = set(ingredient_ids)
+    counts = Counter(chain.from_iterable(
+        postings.get(pk, ()) for pk in pantry
+    ))
+    sizes = {}
+    for recipe_id, ingredients in overlay.items():
+        counts.pop(recipe_id, None)
+        matched = len(ingredients & pantry)
+        if matched:
+            counts[recipe_id] = matched
+            sizes[recipe_id] = len(ingredients)
+    ranked = []
+    for recipe_id, matched in counts.items():
+        total = sizes[recipe_id] if recipe_id in sizes else totals[recipe_id]
+        missing = total - matched
+        if missing <= max_missing:
+            ranked.append((missing, -recipe_id))
+    ranked.sort()
+    return [(-recipe_id, missing) for missing, recipe_id in ranked]
+
+
+def match_in_database(ingredient_ids, max_missing):
+    return list(
+        Recipe.objects.order_by()
+        .annotate(
+            matched=Count(
+                'recipe_ingredients',
+                filter=Q(recipe_ingredients__ingredient__in=ingredient_ids),
+            ),
+            total=Count('recipe_ingredients'),
+        )
+        .annotate(missing=F('total') - F('matched'))
+        .filter(matched__gt=0, missing__lte=max_missing)
+        .order_by('missing', '-id')
+        .values_list('pk', 'missing')
+    )
+
+
+class PantryIndex:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirty_lock = threading.Lock()
+        self._data = None
+        self._built_at = 0
+        self._dirty = set()
+        self._building = None
+
+    def invalidate(self):
+        with self._lock:
+            self._built_at = 0
+
+    def mark_dirty(self, recipe_id):
+        def add():
+            with self._dirty_lock:
+                self._dirty.add(recipe_id)
+        transaction.on_commit(add)
+
+    def _take_dirty(self):
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        if self._building is not None:
+            self._building |= dirty
+        return dirty
+
+    def _is_stale(self, data):
+        return (
+            data is None
+            or time.monotonic() - self._built_at >= settings.PANTRY_INDEX_TTL
+            or len(data[2]) > settings.PANTRY_INDEX_MAX_OVERLAY
+        )
+
+    def build(self):
+        size = RecipeIngredient.objects.aggregate(
+            last=Max('recipe_id')
+        )['last'] or 0
+        rows = (
+            RecipeIngredient.objects.order_by()
+            .values_list('recipe_id', 'ingredient_id')
+            .iterator(chunk_size=CHUNK_SIZE)
+        )
+        postings, totals = build_index(rows, size)
+        return postings, totals, {}
+
+    def _refresh(self, data, dirty):
+        postings, totals, overlay = data
+        overlay = {**overlay, **{recipe_id: set() for recipe_id in dirty}}
+        for recipe_id, ingredient_id in (
+            RecipeIngredient.objects.order_by()
+            .filter(recipe_id__in=dirty)
+            .values_list('recipe_id', 'ingredient_id')
+        ):
+            overlay[recipe_id].add(ingredient_id)
+        return postings, totals, overlay
+
+    def rebuild(self):
+        with self._lock:
+            self._take_dirty()
+            self._building = set()
+        try:
+            data = self.build()
+        except Exception:
+            with self._lock:
+                self._building = None
+            raise
+        with self._lock:
+            dirty = self._building | self._take_dirty()
+            self._building = None
+            if dirty:
+                data = self._refresh(data, dirty)
+            self._data = data
+            self._built_at = time.monotonic()
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception('Не удалось перестроить индекс ингредиентов')
+        finally:
+            connection.close()
+
+    def start_rebuild(self):
+        with self._lock:
+            if self._building is not None:
+                return
+            self._building = set()
+        threading.Thread(
+            target=self._rebuild_in_background,
+            name='pantry-index',
+            daemon=True,
+        ).start()
+
+    def _load(self):
+        data = self._data
+        if data is None or self._dirty:
+            with self._lock:
+                data = self._data
+                dirty = self._take_dirty()
+                if data is not None and dirty:
+                    data = self._refresh(data, dirty)
+                    self._data = data
+        if self._is_stale(data):
+            self.start_rebuild()
+        return data
+
+    def match(self, ingredient_ids, max_missing):
+        data = self._load()
+        if data is None:
+            return match_in_database(ingredient_ids, max_missing)
+        postings, totals, overlay = data
+        return rank_matches(
+            postings, totals, overlay, ingredient_ids, max_missing
+        )
+
+
+pantry_index = PantryIndex()
@@ -0,0 +1,31 @@
+import json
+
+from rest_framework import renderers
+
+
+class ExportRenderer(renderers.BaseRenderer):
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        response = (renderer_context or {}).get('response')
+        if response is not None:
+            response['Content-Type'] = 'application/json'
+        return json.dumps(data, ensure_ascii=False).encode()
+
+
+class TextRenderer(ExportRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CSVRenderer(ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class PDFRenderer(ExportRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
@@ -0,0 +1,226 @@
+import bisect
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection, transaction
+from django.db.models import F, FloatField, OuterRef, Subquery, Value
+from django.db.models.expressions import RawSQL
+
+from recipes.models import Ingredient, Recipe, RecipeIngredient
+
+from .cache import get_version
+
+SEARCH_ORDERING = ('-rank', '-pub_date', '-id')
+
+pending = threading.local()
+
+
+def fold(value):
+    return value.strip().casefold().replace('ё', 'е')
+
+
+class IngredientIndex:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+        self._version = None
+        self._built_at = 0
+
+    def invalidate(self):
+        self._data = None
+
+    def _load(self):
+        data = self._data
+        version = get_version('ingredients')
+        ttl = settings.INGREDIENTS_INDEX_TTL
+        if (
+            data is not None
+            and self._version == version
+            and time.monotonic() - self._built_at < ttl
+        ):
+            return data
+        with self._lock:
+            if self._data is data:
+                rows = sorted(
+                    (fold(name), pk, name, unit)
+                    for pk, name, unit in Ingredient.objects.values_list(
+                        'id', 'name', 'measurement_unit'
+                    )
+                )
+                keys = [row[0] for row in rows]
+                items = [
+                    {'id': pk, 'name': name, 'measurement_unit': unit}
+                    for _, pk, name, unit in rows
+                ]
+                self._data = keys, items
+                self._version = version
+                self._built_at = time.monotonic()
+            return self._data
+
+    def search(self, name, limit=None):
+        keys, items = self._load()
+        query = fold(name)
+        result = []
+        start = bisect.bisect_left(keys, query)
+        for position in range(start, len(keys)):
+            if limit and len(result) >= limit:
+                return result
+            if not keys[position].startswith(query):
+                break
+            result.append(items[position])
+        for key, item in zip(keys, items):
+            if limit and len(result) >= limit:
+                break
+            if query in key and not key.startswith(query):
+                result.append(item)
+        return result
+
+
+ingredient_index = IngredientIndex()
+
+
+def get_search_vector():
+    config = settings.SEARCH_CONFIG
+    ingredients = Subquery(
+        RecipeIngredient.objects
+        .filter(recipe=OuterRef('pk'))
+        .order_by()
+        .values('recipe')
+        .annotate(names=StringAgg('ingredient__name', ' '))
+        .values('names')
+    )
+    return (
+        SearchVector('name', weight='A', config=config)
+        + SearchVector(ingredients, weight='B', config=config)
+        + SearchVector('text', weight='C', config=config)
+    )
+
+
+FTS_TABLE = 'recipes_recipe_fts'
+FTS_WEIGHTS = (10.0, 5.0, 1.0)
+FTS_TERM = re.compile(r'(-?)"([^"]*)"?|(\S+)')
+FTS_TOKEN = re.compile(r'[^\W_]+')
+
+
+def fold_sql(column):
+    return f"REPLACE(REPLACE({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def update_fts(recipe_ids):
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return 0
+    ids = ', '.join(['%s'] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({ids})', recipe_ids
+        )
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, ingredients, text) '
+            f'SELECT recipe.id, {fold_sql("recipe.name")}, '
+            f'{fold_sql("GROUP_CONCAT(ingredient.name, %s)")}, '
+            f'{fold_sql("recipe.text")} '
+            f'FROM recipes_recipe recipe '
+            f'LEFT JOIN recipes_recipeingredient item '
+            f'ON item.recipe_id = recipe.id '
+            f'LEFT JOIN recipes_ingredient ingredient '
+            f'ON ingredient.id = item.ingredient_id '
+            f'WHERE recipe.id IN ({ids}) GROUP BY recipe.id',
+            [' ', *recipe_ids],
+        )
+        return cursor.rowcount
+
+
+def update_search_vectors(recipes):
+    if connection.vendor == 'postgresql':
+        return recipes.update(search_vector=get_search_vector())
+    return update_fts(recipes.values_list('pk', flat=True))
+
+
+def flush_search_updates():
+    recipe_ids = pending.__dict__.pop('recipe_ids', None)
+    if not recipe_ids:
+        return
+    if connection.vendor == 'postgresql':
+        update_search_vectors(Recipe.objects.filter(pk__in=recipe_ids))
+    else:
+        update_fts(recipe_ids)
+
+
+def schedule_search_update(recipe_ids):
+    pending.__dict__.setdefault('recipe_ids', set()).update(recipe_ids)
+    transaction.on_commit(flush_search_updates)
+
+
+def get_fts_term(text, prefix):
+    tokens = FTS_TOKEN.findall(text)
+    if not tokens:
+        return None
+    if len(tokens) == 1 and prefix:
+        return f'"{tokens[0]}"*'
+    return '"{}"'.format(' '.join(tokens))
+
+
+def get_fts_query(value):
+    include = []
+    exclude = []
+    operator = None
+    for negate, phrase, word in FTS_TERM.findall(fold(value)):
+        if word == 'or':
+            operator = 'OR'
+            continue
+        if word.startswith('-'):
+            negate, word = '-', word[1:]
+        term = get_fts_term(phrase or word, prefix=not phrase)
+        if term is None:
+            continue
+        if negate:
+            exclude.append(term)
+        elif include and operator:
+            include[-1] = f'({include[-1]} OR {term})'
+        else:
+            include.append(term)
+        operator = None
+    return (
+        ' AND '.join(include) or None,
+        ' OR '.join(exclude) or None,
+    )
+
+
+def match_fts(query):
+    return RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+        (query,),
+    )
+
+
+def search_recipes(recipes, value):
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(
+            value, config=settings.SEARCH_CONFIG, search_type='websearch'
+        )
+        return recipes.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        ).order_by(*SEARCH_ORDERING)
+    include, exclude = get_fts_query(value)
+    if include is None:
+        if exclude is None:
+            return recipes.none()
+        return recipes.exclude(pk__in=match_fts(exclude)).annotate(
+            rank=Value(0.0, output_field=FloatField())
+        ).order_by(*SEARCH_ORDERING)
+    query = include if exclude is None else f'{include} NOT ({exclude})'
+    weights = ', '.join(map(str, FTS_WEIGHTS))
+    return recipes.filter(pk__in=match_fts(query)).annotate(rank=RawSQL(
+        f'SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+        f'WHERE {FTS_TABLE} MATCH %s '
+        f'AND rowid = {Recipe._meta.db_table}.id',
+        (query,),
+        output_field=FloatField(),
+    )).order_by(*SEARCH_ORDERING)
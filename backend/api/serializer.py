@@ -1,3 +1,6 @@
+from collections import Counter
+
+from django.conf import settings
 from django.contrib.auth.password_validation import validate_password
 from django.core import exceptions
 from django.db import transaction
@@ -8,6 +11,12 @@ from rest_framework import serializers
 from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
 from users.models import User
 
+from .cache import bump_version
+from .fields import StreamingBase64ImageField
+from .images import get_variant_urls, schedule_delete_image, schedule_variants
+from .services import (get_recipes_limit, get_subscribed_ids,
+                       recipe_ingredients_changed)
+
 MAX_LIMIT = 32000
 MIN_LIMIT = 1
 
@@ -28,14 +37,15 @@ class CustomUserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, validated_data):
+        if hasattr(validated_data, 'is_subscribed'):
+            return validated_data.is_subscribed
         if (
             self.context.get('request')
             and not self.context['request'].user.is_anonymous
+            and validated_data.id != self.context['request'].user.id
         ):
-            return (
+            return validated_data.id in get_subscribed_ids(
                 self.context['request']
-                .user.subscriber.filter(author=validated_data)
-                .exists()
             )
         return False
 
@@ -80,19 +90,56 @@ class PasswordSetSerializer(serializers.Serializer):
                 {'new_password': 'Новый пароль должен отличаться от текущего.'}
             )
         instance.set_password(validated_data['new_password'])
-        instance.save()
+        instance.save(update_fields=['password'])
         return validated_data
 
 
 class RecipeListSerializer(serializers.ModelSerializer):
 
     image = Base64ImageField(read_only=True)
+    image_variants = serializers.SerializerMethodField()
     name = serializers.ReadOnlyField()
     cooking_time = serializers.ReadOnlyField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
+
+    def get_image_variants(self, data):
+        return get_variant_urls(
+            data.image_variants, self.context.get('request')
+        )
+
+
+class PantrySerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=settings.PANTRY_MAX_INGREDIENTS,
+    )
+    max_missing = serializers.IntegerField(
+        min_value=0,
+        max_value=settings.PANTRY_MAX_MISSING,
+        default=settings.PANTRY_MAX_MISSING,
+    )
+
+
+class PantryRecipeSerializer(RecipeListSerializer):
+    missing_count = serializers.SerializerMethodField()
+    missing = serializers.SerializerMethodField()
+
+    class Meta(RecipeListSerializer.Meta):
+        fields = RecipeListSerializer.Meta.fields + (
+            'missing_count', 'missing'
+        )
+
+    def get_missing_count(self, data):
+        return len(self.context['missing'].get(data.id, ()))
+
+    def get_missing(self, data):
+        return IngredientSerializer(
+            self.context['missing'].get(data.id, ()), many=True
+        ).data
 
 
 class SubscriptionsSerializer(CustomUserSerializer):
@@ -113,16 +160,21 @@ class SubscriptionsSerializer(CustomUserSerializer):
         )
 
     def get_recipes(self, data):
-        request = self.context.get('request')
-        limit = request.query_params.get('recipes_limit')
-        recipes = Recipe.objects.filter(author=data)
-        if limit:
-            recipes = recipes[:int(limit)]
-        serializer = RecipeSerializer(recipes, many=True)
+        recipes = getattr(data, 'limited_recipes', None)
+        if recipes is None:
+            recipes = data.recipes.all()
+            limit = get_recipes_limit(self.context.get('request'))
+            if limit is not None:
+                recipes = recipes[:limit]
+        serializer = RecipeListSerializer(
+            recipes, many=True, context=self.context
+        )
         return serializer.data
 
     def get_recipes_count(self, data):
-        return Recipe.objects.filter(author=data).count()
+        if hasattr(data, 'recipes_count'):
+            return data.recipes_count
+        return data.recipes.count()
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -163,6 +215,7 @@ class RecipeSerializer(serializers.ModelSerializer):
     name = serializers.ReadOnlyField()
     cooking_time = serializers.ReadOnlyField()
     image = Base64ImageField()
+    image_variants = serializers.SerializerMethodField()
     author = CustomUserSerializer(read_only=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
@@ -177,12 +230,20 @@ class RecipeSerializer(serializers.ModelSerializer):
             'is_favorited',
             'is_in_shopping_cart',
             'image',
+            'image_variants',
             'name',
             'cooking_time',
             'text',
         )
 
+    def get_image_variants(self, data):
+        return get_variant_urls(
+            data.image_variants, self.context.get('request')
+        )
+
     def get_is_favorited(self, data):
+        if hasattr(data, 'is_favorited'):
+            return data.is_favorited
         user = self.context.get('request').user
         return (
             user.is_authenticated
@@ -190,6 +251,8 @@ class RecipeSerializer(serializers.ModelSerializer):
         )
 
     def get_is_in_shopping_cart(self, data):
+        if hasattr(data, 'is_in_shopping_cart'):
+            return data.is_in_shopping_cart
         user = self.context.get('request').user
         return (
             user.is_authenticated
@@ -199,23 +262,44 @@ class RecipeSerializer(serializers.ModelSerializer):
 
 class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
 
-    id = serializers.PrimaryKeyRelatedField(
-        source='ingredient',
-        queryset=Ingredient.objects.all(),
-    )
+    id = serializers.IntegerField()
 
     class Meta:
         model = RecipeIngredient
         fields = ('id', 'amount')
 
 
+def resolve_ids(model, ids, label):
+    duplicates = sorted(pk for pk, count in Counter(ids).items() if count > 1)
+    objects = model.objects.in_bulk(set(ids))
+    missing = sorted(set(ids) - objects.keys())
+    errors = []
+    if duplicates:
+        errors.append(
+            f'{label} не могут повторяться: '
+            f'{", ".join(map(str, duplicates))}.'
+        )
+    if missing:
+        errors.append(
+            f'{label} не найдены: {", ".join(map(str, missing))}.'
+        )
+    return objects, errors
+
+
+def cache_related(instance, name, objects):
+    prefetched = instance.__dict__.setdefault('_prefetched_objects_cache', {})
+    prefetched.pop(name, None)
+    queryset = getattr(instance, name).all()
+    queryset._result_cache = list(objects)
+    queryset._prefetch_done = True
+    prefetched[name] = queryset
+
+
 class RecipeCreateSerializer(serializers.ModelSerializer):
 
     ingredients = RecipeIngredientCreateSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        many=True, queryset=Tag.objects.all()
-    )
-    image = Base64ImageField(required=False, allow_null=True)
+    tags = serializers.ListField(child=serializers.IntegerField())
+    image = StreamingBase64ImageField(required=False, allow_null=True)
     author = CustomUserSerializer(read_only=True)
     cooking_time = serializers.IntegerField(
         max_value=MAX_LIMIT, min_value=MIN_LIMIT
@@ -234,37 +318,35 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         )
 
     def validate(self, data):
-        ingredients = self.initial_data.get('ingredients')
-        tags = self.initial_data.get('tags')
-        image = self.initial_data.get('image')
-        list_ingredients = []
-        list_tags = []
+        ingredients = data.get('ingredients')
+        tags = data.get('tags')
+        errors = {}
         if not ingredients:
-            raise serializers.ValidationError(
-                {'ingredients': 'Нужно выбрать хотя бы один ингредиент!'})
-        for ingredient in ingredients:
-            amount = ingredient['amount']
-            if ingredient['id'] in list_ingredients:
-                raise serializers.ValidationError({
-                    'ingredient': 'Ингредиенты не могут повторяться!'
-                })
-            list_ingredients.append(ingredient['id'])
-            if int(amount) < 1:
-                raise serializers.ValidationError({
-                    'amount': 'Количество ингредиента должно быть больше 0!'
-                })
+            errors['ingredients'] = 'Нужно выбрать хотя бы один ингредиент!'
+        else:
+            found, messages = resolve_ids(
+                Ingredient, [item['id'] for item in ingredients],
+                'Ингредиенты'
+            )
+            if messages:
+                errors['ingredients'] = messages
+            else:
+                data['ingredients'] = [
+                    {'ingredient': found[item['id']], 'amount': item['amount']}
+                    for item in ingredients
+                ]
         if not tags:
-            raise serializers.ValidationError(
-                {'tags': 'Нужно выбрать хотя бы один тег!'})
-        for tag in tags:
-            if tag in list_tags:
-                raise serializers.ValidationError({
-                    'ingredient': 'Ингредиенты не могут повторяться!'
-                })
-            list_tags.append(tag)
-        if not image:
-            raise serializers.ValidationError(
-                {'image': 'Нужно выбрать картинку!'})
+            errors['tags'] = 'Нужно выбрать хотя бы один тег!'
+        else:
+            found, messages = resolve_ids(Tag, tags, 'Теги')
+            if messages:
+                errors['tags'] = messages
+            else:
+                data['tags'] = [found[pk] for pk in tags]
+        if not self.initial_data.get('image'):
+            errors['image'] = 'Нужно выбрать картинку!'
+        if errors:
+            raise serializers.ValidationError(errors)
         return data
 
     def add_ingredients(self, recipe, ingredients):
@@ -279,19 +361,95 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             )
         return RecipeIngredient.objects.bulk_create(objs)
 
+    def update_ingredients(self, recipe, ingredients):
+        current = {
+            item.ingredient_id: item
+            for item in recipe.recipe_ingredients.all()
+        }
+        amounts = {
+            ingredient_data['ingredient'].id: ingredient_data['amount']
+            for ingredient_data in ingredients
+        }
+        changed = []
+        for ingredient_id, item in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and amount != item.amount:
+                item.amount = amount
+                changed.append(item)
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+            bump_version('recipes')
+        added = self.add_ingredients(recipe, [
+            ingredient_data for ingredient_data in ingredients
+            if ingredient_data['ingredient'].id not in current
+        ])
+        removed = current.keys() - amounts.keys()
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipe=recipe, ingredient_id__in=removed
+            ).delete()
+        if added or removed:
+            recipe_ingredients_changed([recipe.pk])
+        cache_related(recipe, 'recipe_ingredients', [
+            item for ingredient_id, item in current.items()
+            if ingredient_id not in removed
+        ] + added)
+        return bool(added or removed)
+
+    def update_tags(self, recipe, tags):
+        current = {tag.id: tag for tag in recipe.tags.all()}
+        selected = {tag.id: tag for tag in tags}
+        if current.keys() == selected.keys():
+            return False
+        removed = current.keys() - selected.keys()
+        if removed:
+            recipe.tags.remove(*removed)
+        added = selected.keys() - current.keys()
+        if added:
+            recipe.tags.add(*added)
+        return True
+
     @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
+        image = validated_data.get('image')
         instance = super().create(validated_data)
-        self.add_ingredients(instance, ingredients)
+        cache_related(
+            instance, 'recipe_ingredients',
+            self.add_ingredients(instance, ingredients),
+        )
+        if image:
+            image.close()
+            schedule_variants(instance.image.name)
         return instance
 
     @transaction.atomic
     def update(self, recipe, validated_data):
         ingredients = validated_data.pop('ingredients')
-        RecipeIngredient.objects.filter(recipe=recipe).delete()
-        self.add_ingredients(recipe, ingredients)
-        return super().update(recipe, validated_data)
+        recomposed = self.update_ingredients(recipe, ingredients)
+        recomposed |= self.update_tags(recipe, validated_data.pop('tags'))
+        image = validated_data.get('image')
+        old_image = recipe.image.name
+        old_variants = recipe.image_variants
+        changed = [
+            field for field, value in validated_data.items()
+            if getattr(recipe, field) != value
+        ]
+        for field in changed:
+            setattr(recipe, field, validated_data[field])
+        if image:
+            recipe.image_variants = {}
+            changed.append('image_variants')
+        if recomposed and not recipe.similar_stale:
+            recipe.similar_stale = True
+            changed.append('similar_stale')
+        if changed:
+            recipe.save(update_fields=changed)
+        if image:
+            image.close()
+            schedule_delete_image(old_image, old_variants)
+            schedule_variants(recipe.image.name)
+        return recipe
 
     def to_representation(self, instance):
         return RecipeSerializer(instance, context=self.context).data
@@ -0,0 +1,500 @@
+from itertools import chain
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import (Count, F, OuterRef, Prefetch, Subquery, Sum,
+                              prefetch_related_objects)
+from rest_framework.exceptions import ValidationError
+
+from recipes.models import (Favorites, Recipe, RecipeIngredient, Shopping_cart,
+                            TimelineEntry)
+from users.models import Subscriptions, User
+
+from .cache import bump_version, get_version
+from .pagination import get_position_filter
+from .pantry import pantry_index
+from .search import schedule_search_update
+
+
+def get_shopping_list(user):
+    return (
+        RecipeIngredient.objects
+        .filter(recipe__shopping_recipe__user=user)
+        .values(
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit'),
+        )
+        .annotate(amount=Sum('amount'))
+        .order_by('name', 'measurement_unit')
+    )
+
+
+UNIT_CONVERSIONS = {
+    'кг': ('г', 1000),
+    'л': ('мл', 1000),
+}
+LARGER_UNITS = {
+    base: (unit, factor) for unit, (base, factor) in UNIT_CONVERSIONS.items()
+}
+
+
+def format_amount(amount, measurement_unit):
+    if measurement_unit in LARGER_UNITS:
+        unit, factor = LARGER_UNITS[measurement_unit]
+        if amount >= factor:
+            return f'{amount / factor:g}', unit
+    return str(amount), measurement_unit
+
+
+def normalize_shopping_list(shopping_list):
+    totals = {}
+    for item in shopping_list:
+        unit, factor = UNIT_CONVERSIONS.get(
+            item['measurement_unit'], (item['measurement_unit'], 1)
+        )
+        key = (item['name'], unit)
+        totals[key] = totals.get(key, 0) + item['amount'] * factor
+    return [
+        (name, *format_amount(amount, unit))
+        for (name, unit), amount in sorted(totals.items())
+    ]
+
+
+def get_missing_ingredients(recipe_ids, ingredient_ids):
+    missing = {}
+    for item in (
+        RecipeIngredient.objects
+        .filter(recipe_id__in=recipe_ids)
+        .exclude(ingredient_id__in=ingredient_ids)
+        .select_related('ingredient')
+        .order_by('ingredient__name')
+    ):
+        missing.setdefault(item.recipe_id, []).append(item.ingredient)
+    return missing
+
+
+RECIPE_PREFETCHES = ('recipe_ingredients__ingredient', 'tags')
+
+
+def get_recipes(user):
+    return Recipe.objects.select_related('author').prefetch_related(
+        *RECIPE_PREFETCHES
+    ).with_user_flags(user)
+
+
+def get_subscribed_ids(request):
+    if not hasattr(request, '_subscribed_ids'):
+        request._subscribed_ids = set(
+            request.user.subscriber.order_by().values_list(
+                'author_id', flat=True
+            )
+        )
+    return request._subscribed_ids
+
+
+def get_recipes_limit(request):
+    limit = request and request.query_params.get('recipes_limit')
+    if limit is None:
+        return None
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValidationError(
+            {'recipes_limit': 'Значение должно быть целым числом.'}
+        )
+    if limit < 0:
+        raise ValidationError(
+            {'recipes_limit': 'Значение не может быть отрицательным.'}
+        )
+    return limit
+
+
+def get_subscriptions(user, recipes_limit=None):
+    recipes = Recipe.objects.all()
+    if recipes_limit == 0:
+        recipes = recipes.none()
+    elif recipes_limit is not None:
+        recipes = recipes.filter(pk__in=Subquery(
+            Recipe.objects.filter(
+                author=OuterRef('author')
+            ).values('pk')[:recipes_limit]
+        ))
+    return (
+        User.objects
+        .filter(subscribing__user=user)
+        .annotate(
+            date_subscriptions=F('subscribing__date_subscriptions'),
+            recipes_count=Count('recipes', distinct=True),
+        )
+        .order_by('-date_subscriptions', '-id')
+        .prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='limited_recipes')
+        )
+    )
+
+
+def get_user_flags(user):
+    key = f'user_flags:{user.id}:{get_version(f"user:{user.id}")}'
+    flags = cache.get(key)
+    if flags is None:
+        flags = {
+            'favorites': set(user.favorite_user.order_by().values_list(
+                'recipe_id', flat=True
+            )),
+            'shopping_cart': set(user.shopping_user.order_by().values_list(
+                'recipe_id', flat=True
+            )),
+            'subscriptions': set(user.subscriber.order_by().values_list(
+                'author_id', flat=True
+            )),
+        }
+        cache.set(key, flags, settings.RECIPES_CACHE_TIMEOUT)
+    return flags
+
+
+def apply_user_flags(recipes, user):
+    if user.is_anonymous:
+        flags = {'favorites': (), 'shopping_cart': (), 'subscriptions': ()}
+    else:
+        flags = get_user_flags(user)
+    for recipe in recipes:
+        recipe['is_favorited'] = recipe['id'] in flags['favorites']
+        recipe['is_in_shopping_cart'] = recipe['id'] in flags['shopping_cart']
+        recipe['author']['is_subscribed'] = (
+            recipe['author']['id'] in flags['subscriptions']
+        )
+    return recipes
+
+
+RELATIONS = {
+    Favorites: ('recipe', Recipe),
+    Shopping_cart: ('recipe', Recipe),
+    Subscriptions: ('author', User),
+}
+
+RECIPE_COUNTERS = {
+    Favorites: 'favorites_count',
+    Shopping_cart: 'cart_count',
+}
+
+
+def recipe_ingredients_changed(recipe_ids):
+    recipe_ids = set(recipe_ids)
+    if not recipe_ids:
+        return
+    schedule_search_update(recipe_ids)
+    for recipe_id in recipe_ids:
+        pantry_index.mark_dirty(recipe_id)
+    bump_version('recipes')
+
+
+def quote_names(*names):
+    return ', '.join(connection.ops.quote_name(name) for name in names)
+
+
+def placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def get_insert_sql(model, user, field, target, ids):
+    relation = model(user=user)
+    columns = []
+    values = []
+    params = []
+    for model_field in model._meta.concrete_fields:
+        if model_field.primary_key:
+            continue
+        columns.append(model_field.column)
+        if model_field.name == field:
+            values.append(connection.ops.quote_name(target._meta.pk.column))
+        elif model_field.name == 'user':
+            values.append('%s')
+            params.append(user.pk)
+        else:
+            values.append('%s')
+            params.append(model_field.get_db_prep_save(
+                model_field.pre_save(relation, True), connection
+            ))
+    condition = (
+        f'{quote_names(target._meta.pk.column)} IN ({placeholders(ids)})'
+    )
+    params.extend(ids)
+    if target is User:
+        condition += f' AND {quote_names(target._meta.pk.column)} <> %s'
+        params.append(user.pk)
+    return (
+        f'INSERT INTO {quote_names(model._meta.db_table)} '
+        f'({quote_names(*columns)}) '
+        f'SELECT {", ".join(values)} '
+        f'FROM {quote_names(target._meta.db_table)} '
+        f'WHERE {condition} '
+        f'ON CONFLICT DO NOTHING '
+        f'RETURNING {quote_names(model._meta.get_field(field).column)}'
+    ), params
+
+
+def get_delete_sql(model, user, field, ids):
+    column = quote_names(model._meta.get_field(field).column)
+    return (
+        f'DELETE FROM {quote_names(model._meta.db_table)} '
+        f'WHERE {quote_names("user_id")} = %s '
+        f'AND {column} IN ({placeholders(ids)}) '
+        f'RETURNING {column}'
+    ), [user.pk, *ids]
+
+
+def get_counter_sql(counter, ids_sql, ids_params, delta):
+    column = quote_names(counter)
+    sql = (
+        f'UPDATE {quote_names(Recipe._meta.db_table)} '
+        f'SET {column} = {column} + %s, {quote_names("similar_stale")} = %s '
+        f'WHERE {quote_names("id")} IN ({ids_sql})'
+    )
+    params = [delta, True, *ids_params]
+    if delta < 0:
+        sql += f' AND {column} >= %s'
+        params.append(-delta)
+    return sql, params
+
+
+def get_change_sql(model, user_id, ids_sql, ids_params, delta):
+    if model is Subscriptions:
+        if delta > 0:
+            return get_backfill_sql(user_id, ids_sql, ids_params)
+        return get_clear_timeline_sql(user_id, ids_sql, ids_params)
+    return get_counter_sql(RECIPE_COUNTERS[model], ids_sql, ids_params, delta)
+
+
+def relations_changed(model, user_id, ids, delta):
+    if not ids:
+        return
+    ids = list(ids)
+    bump_version(f'user:{user_id}')
+    with connection.cursor() as cursor:
+        cursor.execute(*get_change_sql(
+            model, user_id, placeholders(ids), ids, delta
+        ))
+
+
+def with_changes(model, user_id, statement, params, delta, query):
+    column = quote_names(
+        model._meta.get_field(RELATIONS[model][0]).column
+    )
+    change_sql, change_params = get_change_sql(
+        model, user_id, f'SELECT {column} FROM {quote_names("changed")}',
+        [], delta,
+    )
+    return (
+        f'WITH {quote_names("changed")} AS ({statement}), '
+        f'{quote_names("change")} AS ({change_sql}) {query}'
+    ), [*params, *change_params]
+
+
+def get_relation_targets(model, ids):
+    _, target = RELATIONS[model]
+    targets = target.objects.filter(pk__in=ids)
+    if model is Subscriptions:
+        targets = targets.annotate(recipes_count=Count('recipes'))
+    return targets
+
+
+def insert_relations(model, user, ids):
+    field, target = RELATIONS[model]
+    targets = get_relation_targets(model, ids)
+    insert_sql, params = get_insert_sql(model, user, field, target, ids)
+    if connection.vendor != 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(insert_sql, params)
+            created = {row[0] for row in cursor.fetchall()}
+        relations_changed(model, user.pk, created, 1)
+        return created, {target.pk: target for target in targets}
+    column = quote_names(model._meta.get_field(field).column)
+    targets_sql, targets_params = targets.query.sql_with_params()
+    sql, params = with_changes(
+        model, user.pk, insert_sql, params, 1,
+        f'SELECT {quote_names("targets")}.*, '
+        f'{quote_names("targets")}.{quote_names(target._meta.pk.column)} '
+        f'IN (SELECT {column} FROM {quote_names("changed")}) '
+        f'AS {quote_names("created")} '
+        f'FROM ({targets_sql}) {quote_names("targets")}',
+    )
+    rows = list(target.objects.raw(sql, [*params, *targets_params]))
+    created = {row.pk for row in rows if row.created}
+    if created:
+        bump_version(f'user:{user.pk}')
+    return created, {row.pk: row for row in rows}
+
+
+def add_relations(model, user, ids):
+    ids = list(dict.fromkeys(ids))
+    created, targets = insert_relations(model, user, ids)
+    results = {}
+    for pk in ids:
+        if pk in created:
+            results[pk] = 'created'
+        elif pk not in targets:
+            results[pk] = 'not_found'
+        elif model is Subscriptions and pk == user.pk:
+            results[pk] = 'self'
+        else:
+            results[pk] = 'exists'
+    if model is Subscriptions:
+        for pk, author in targets.items():
+            author.is_subscribed = results[pk] != 'self'
+    return results, targets
+
+
+def remove_relations(model, user, ids):
+    field, _ = RELATIONS[model]
+    ids = list(dict.fromkeys(ids))
+    delete_sql, params = get_delete_sql(model, user, field, ids)
+    if connection.vendor == 'postgresql':
+        delete_sql, params = with_changes(
+            model, user.pk, delete_sql, params, -1,
+            f'SELECT * FROM {quote_names("changed")}',
+        )
+    with connection.cursor() as cursor:
+        cursor.execute(delete_sql, params)
+        deleted = {row[0] for row in cursor.fetchall()}
+    if connection.vendor == 'postgresql':
+        if deleted:
+            bump_version(f'user:{user.pk}')
+    else:
+        relations_changed(model, user.pk, deleted, -1)
+    return {
+        pk: 'deleted' if pk in deleted else 'missing'
+        for pk in ids
+    }
+
+
+TIMELINE_ORDERING = ('-pub_date', '-recipe_id')
+FEED_ORDERING = ('-pub_date', '-id')
+TIMELINE_TABLE = connection.ops.quote_name(TimelineEntry._meta.db_table)
+
+
+def get_pull_authors():
+    key = f'timeline_pull:{get_version("timeline_pull")}'
+    authors = cache.get(key)
+    if authors is None:
+        authors = set(User.objects.filter(
+            timeline_pull=True
+        ).values_list('pk', flat=True))
+        cache.set(key, authors, settings.REFERENCE_CACHE_TIMEOUT)
+    return authors
+
+
+def fan_out_recipe(recipe):
+    author = recipe.author
+    if author.pk not in get_pull_authors():
+        followers = Subscriptions.objects.filter(author=author).order_by()
+        if followers[:settings.TIMELINE_FANOUT_LIMIT + 1].count() <= (
+            settings.TIMELINE_FANOUT_LIMIT
+        ):
+            pub_date = TimelineEntry._meta.get_field(
+                'pub_date'
+            ).get_db_prep_save(recipe.pub_date, connection)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {TIMELINE_TABLE} '
+                    f'({quote_names("user_id", "recipe_id", "pub_date")}) '
+                    f'SELECT {quote_names("user_id")}, %s, %s '
+                    f'FROM {quote_names(Subscriptions._meta.db_table)} '
+                    f'WHERE {quote_names("author_id")} = %s '
+                    f'ON CONFLICT DO NOTHING',
+                    [recipe.pk, pub_date, author.pk],
+                )
+            return
+        User.objects.filter(pk=author.pk).update(timeline_pull=True)
+        author.timeline_pull = True
+        bump_version('timeline_pull')
+
+
+def get_backfill_sql(user_id, authors_sql, authors_params):
+    recipe = quote_names(Recipe._meta.db_table)
+    author = quote_names(User._meta.db_table)
+    return (
+        f'INSERT INTO {TIMELINE_TABLE} '
+        f'({quote_names("user_id", "recipe_id", "pub_date")}) '
+        f'SELECT %s, {quote_names("id", "pub_date")} FROM ('
+        f'SELECT {recipe}.{quote_names("id")}, '
+        f'{recipe}.{quote_names("pub_date")}, ROW_NUMBER() OVER ('
+        f'PARTITION BY {recipe}.{quote_names("author_id")} '
+        f'ORDER BY {recipe}.{quote_names("pub_date")} DESC, '
+        f'{recipe}.{quote_names("id")} DESC'
+        f') AS {quote_names("position")} '
+        f'FROM {recipe} INNER JOIN {author} '
+        f'ON {author}.{quote_names("id")} = '
+        f'{recipe}.{quote_names("author_id")} '
+        f'WHERE {recipe}.{quote_names("author_id")} '
+        f'IN ({authors_sql}) '
+        f'AND {author}.{quote_names("timeline_pull")} = %s'
+        f') {quote_names("ranked")} '
+        f'WHERE {quote_names("position")} <= %s '
+        f'ON CONFLICT DO NOTHING'
+    ), [
+        user_id, *authors_params, False, settings.TIMELINE_BACKFILL_LIMIT,
+    ]
+
+
+def get_clear_timeline_sql(user_id, authors_sql, authors_params):
+    return (
+        f'DELETE FROM {TIMELINE_TABLE} '
+        f'WHERE {quote_names("user_id")} = %s '
+        f'AND {quote_names("recipe_id")} IN ('
+        f'SELECT {quote_names("id")} '
+        f'FROM {quote_names(Recipe._meta.db_table)} '
+        f'WHERE {quote_names("author_id")} IN ({authors_sql}))'
+    ), [user_id, *authors_params]
+
+
+def backfill_timeline(user_id, author_ids):
+    if not author_ids:
+        return
+    author_ids = list(author_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(*get_backfill_sql(
+            user_id, placeholders(author_ids), author_ids
+        ))
+
+
+def clear_timeline(user_id, author_ids):
+    if not author_ids:
+        return
+    author_ids = list(author_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(*get_clear_timeline_sql(
+            user_id, placeholders(author_ids), author_ids
+        ))
+
+
+def get_timeline(user, cursor, page_size):
+    entries = TimelineEntry.objects.filter(user=user).order_by(
+        *TIMELINE_ORDERING
+    )
+    if cursor:
+        entries = entries.filter(get_position_filter(
+            TIMELINE_ORDERING, cursor
+        ))
+    recipes = Recipe.objects.select_related('author').with_user_flags(
+        user
+    ).order_by(*FEED_ORDERING)
+    page = list(recipes.filter(
+        pk__in=entries.values('recipe_id')[:page_size + 1]
+    ))
+    authors = get_user_flags(user)['subscriptions'] & get_pull_authors()
+    if authors:
+        pulled = recipes.filter(author_id__in=authors)
+        if cursor:
+            pulled = pulled.filter(get_position_filter(FEED_ORDERING, cursor))
+        page = sorted(
+            {
+                recipe.pk: recipe
+                for recipe in chain(page, pulled[:page_size + 1])
+            }.values(),
+            key=lambda recipe: (recipe.pub_date, recipe.pk),
+            reverse=True,
+        )
+    page = page[:page_size + 1]
+    prefetch_related_objects(page, *RECIPE_PREFETCHES)
+    return page
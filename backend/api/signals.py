@@ -0,0 +1,164 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (Favorites, Ingredient, Recipe, RecipeIngredient,
+                            Shopping_cart, Tag)
+from recipes.signals import ingredients_changed
+from users.models import Subscriptions, User
+from users.signals import users_updated
+
+from .authentication import token_cache
+from .cache import bump_version
+from .images import schedule_delete_image
+from .middleware import count_queries
+from .pantry import pantry_index
+from .search import (ingredient_index, schedule_search_update,
+                     update_search_vectors)
+from .services import (RELATIONS, fan_out_recipe, recipe_ingredients_changed,
+                       relations_changed)
+
+
+@receiver(connection_created)
+def install_query_counter(connection, **kwargs):
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, count_queries)
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredients(**kwargs):
+    bump_version('ingredients')
+    bump_version('recipes')
+    ingredient_index.invalidate()
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_recipes(instance, created, **kwargs):
+    if not created:
+        update_search_vectors(Recipe.objects.filter(ingredients=instance))
+
+
+@receiver(pre_delete, sender=Ingredient)
+def update_deleted_ingredient_recipes(instance, **kwargs):
+    recipe_ingredients_changed(RecipeIngredient.objects.filter(
+        ingredient=instance
+    ).values_list('recipe_id', flat=True))
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def update_recipe_search(instance, **kwargs):
+    schedule_search_update([instance.pk])
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def update_recipe_ingredients(instance, **kwargs):
+    recipe_ingredients_changed([instance.recipe_id])
+
+
+@receiver(ingredients_changed)
+def update_changed_recipes(recipe_ids, **kwargs):
+    recipe_ingredients_changed(recipe_ids)
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def update_recipe_pantry(instance, **kwargs):
+    pantry_index.mark_dirty(instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_recipe_image(instance, **kwargs):
+    schedule_delete_image(instance.image.name, instance.image_variants)
+
+
+@receiver(post_save, sender=Recipe)
+def mark_recipe_similar_stale(instance, created, **kwargs):
+    if not created and not instance.similar_stale:
+        Recipe.objects.filter(pk=instance.pk).update(similar_stale=True)
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_new_recipe(instance, created, **kwargs):
+    if created:
+        fan_out_recipe(instance)
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_tags(**kwargs):
+    bump_version('tags')
+    bump_version('recipes')
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipes(**kwargs):
+    bump_version('recipes')
+
+
+AUTHOR_FIELDS = ('username', 'first_name', 'last_name', 'email')
+
+
+@receiver(pre_save, sender=User)
+def remember_author_fields(instance, update_fields=None, **kwargs):
+    if instance._state.adding or (
+        update_fields is not None
+        and set(update_fields).isdisjoint(AUTHOR_FIELDS)
+    ):
+        return
+    instance._saved_author_fields = User.objects.filter(
+        pk=instance.pk
+    ).values_list(*AUTHOR_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def invalidate_authors(instance, **kwargs):
+    saved = instance.__dict__.pop('_saved_author_fields', None)
+    if saved is None or saved == tuple(
+        getattr(instance, field) for field in AUTHOR_FIELDS
+    ):
+        return
+    if instance.recipes.exists():
+        bump_version('recipes')
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(instance, **kwargs):
+    token_cache.invalidate(instance.key)
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    token_cache.invalidate_user(instance.pk)
+
+
+@receiver(users_updated)
+def invalidate_updated_user_tokens(user_ids, **kwargs):
+    token_cache.invalidate_users(user_ids)
+
+
+def get_relation_target(sender, instance):
+    field, _ = RELATIONS[sender]
+    return getattr(instance, f'{field}_id')
+
+
+@receiver(post_save, sender=Favorites)
+@receiver(post_save, sender=Shopping_cart)
+@receiver(post_save, sender=Subscriptions)
+def relation_created(sender, instance, created, **kwargs):
+    if created:
+        relations_changed(
+            sender, instance.user_id,
+            [get_relation_target(sender, instance)], 1,
+        )
+
+
+@receiver(post_delete, sender=Favorites)
+@receiver(post_delete, sender=Shopping_cart)
+@receiver(post_delete, sender=Subscriptions)
+def relation_deleted(sender, instance, **kwargs):
+    relations_changed(
+        sender, instance.user_id, [get_relation_target(sender, instance)], -1
+    )
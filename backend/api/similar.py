@@ -0,0 +1,148 @@
+import heapq
+import math
+from array import array
+from collections import Counter, defaultdict
+from itertools import chain
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+
+from recipes.models import (Favorites, Recipe, RecipeIngredient, Shopping_cart,
+                            SimilarRecipe)
+
+from .pantry import CHUNK_SIZE, build_index
+
+
+def get_interactions(recipe_ids=None):
+    favorites = Favorites.objects.order_by()
+    carts = Shopping_cart.objects.order_by()
+    if recipe_ids is not None:
+        favorites = favorites.filter(recipe_id__in=recipe_ids)
+        carts = carts.filter(recipe_id__in=recipe_ids)
+    return favorites.values_list('user_id', 'recipe_id').union(
+        carts.values_list('user_id', 'recipe_id')
+    )
+
+
+def group_links(rows):
+    links = defaultdict(lambda: array('l'))
+    for key, value in rows:
+        links[key].append(value)
+    return dict(links)
+
+
+def overlap(first, second):
+    union = bin(first | second).count('1')
+    return bin(first & second).count('1') / union if union else 0
+
+
+class SimilarityModel:
+
+    def __init__(self):
+        self.size = Recipe.objects.aggregate(last=Max('pk'))['last'] or 0
+        self.max_posting = settings.SIMILAR_RECIPES_MAX_POSTING
+        self.weights = settings.SIMILAR_RECIPES_WEIGHTS
+        self.user_recipes = group_links(
+            get_interactions().iterator(chunk_size=CHUNK_SIZE)
+        )
+        self.popularity = array('l', bytes(8 * (self.size + 1)))
+        for recipes in self.user_recipes.values():
+            for recipe_id in recipes:
+                self.popularity[recipe_id] += 1
+        self.ingredient_recipes, self.ingredient_counts = build_index(
+            RecipeIngredient.objects.order_by()
+            .values_list('recipe_id', 'ingredient_id')
+            .iterator(chunk_size=CHUNK_SIZE),
+            self.size,
+        )
+        self.tags = [0] * (self.size + 1)
+        for recipe_id, tag_id in (
+            Recipe.tags.through.objects.order_by()
+            .values_list('recipe_id', 'tag_id')
+            .iterator(chunk_size=CHUNK_SIZE)
+        ):
+            self.tags[recipe_id] |= 1 << tag_id
+
+    def neighbours(self, links, keys):
+        return Counter(chain.from_iterable(
+            links[key] for key in keys
+            if key in links and len(links[key]) <= self.max_posting
+        ))
+
+    def similar(self, recipe_id, users, ingredients, limit):
+        together = self.neighbours(self.user_recipes, users)
+        shared = self.neighbours(self.ingredient_recipes, ingredients)
+        scores = []
+        for candidate in together.keys() | shared.keys():
+            if candidate == recipe_id:
+                continue
+            common = shared[candidate]
+            cosine = together[candidate] / math.sqrt(
+                len(users) * self.popularity[candidate]
+            ) if together[candidate] else 0
+            jaccard = common / (
+                len(ingredients) + self.ingredient_counts[candidate] - common
+            ) if common else 0
+            score = (
+                self.weights['favorites'] * cosine
+                + self.weights['ingredients'] * jaccard
+                + self.weights['tags'] * overlap(
+                    self.tags[recipe_id], self.tags[candidate]
+                )
+            )
+            scores.append((score, candidate))
+        return heapq.nlargest(limit, scores)
+
+    def build(self, recipe_ids, limit):
+        users = group_links(
+            (recipe_id, user_id)
+            for user_id, recipe_id in get_interactions(recipe_ids)
+        )
+        ingredients = group_links(
+            RecipeIngredient.objects.order_by()
+            .filter(recipe_id__in=recipe_ids)
+            .values_list('recipe_id', 'ingredient_id')
+        )
+        return [
+            SimilarRecipe(recipe_id=recipe_id, similar_id=similar, score=score)
+            for recipe_id in recipe_ids
+            for score, similar in self.similar(
+                recipe_id,
+                users.get(recipe_id, ()),
+                ingredients.get(recipe_id, ()),
+                limit,
+            )
+        ]
+
+
+def save_similar(recipe_ids, rows):
+    existing = set(Recipe.objects.filter(
+        pk__in={row.similar_id for row in rows}
+    ).values_list('pk', flat=True))
+    SimilarRecipe.objects.filter(recipe_id__in=recipe_ids).delete()
+    SimilarRecipe.objects.bulk_create(
+        row for row in rows if row.similar_id in existing
+    )
+
+
+def build_similar_recipes(recipes, limit, batch_size):
+    recipe_ids = list(recipes.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(recipe_ids), batch_size):
+        Recipe.objects.filter(
+            pk__in=recipe_ids[start:start + batch_size]
+        ).update(similar_stale=False)
+    model = SimilarityModel()
+    for start in range(0, len(recipe_ids), batch_size):
+        batch = recipe_ids[start:start + batch_size]
+        try:
+            rows = model.build(batch, limit)
+            with transaction.atomic():
+                save_similar(batch, rows)
+        except BaseException:
+            for rest in range(start, len(recipe_ids), batch_size):
+                Recipe.objects.filter(
+                    pk__in=recipe_ids[rest:rest + batch_size]
+                ).update(similar_stale=True)
+            raise
+        yield len(batch)
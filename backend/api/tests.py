@@ -0,0 +1,1513 @@
+import base64
+import csv
+import datetime
+import io
+import re
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock
+
+from django.conf import settings
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+
+from api.authentication import token_cache
+from api.cache import get_version
+from api.exports import export_pdf
+from api.filters import POPULAR_ORDERING
+from api.middleware import QueryBudgetExceeded, endpoint_stats, get_endpoint
+from api.pagination import decode_cursor, encode_cursor, get_position_filter
+from api.pantry import (PantryIndex, build_index, match_in_database,
+                        pantry_index, rank_matches)
+from api.search import (FTS_TABLE, get_fts_query, search_recipes,
+                        update_search_vectors)
+from api.serializer import RecipeCreateSerializer, RecipeListSerializer
+from api.services import normalize_shopping_list
+from recipes.admin import RecipeIngredientAdmin
+from recipes.management.commands.check_query_plans import (disable_seq_scan,
+                                                           get_checks,
+                                                           get_plan_problems)
+from recipes.models import (Favorites, Ingredient, Recipe, RecipeIngredient,
+                            Shopping_cart, Tag, TimelineEntry)
+from users.models import Subscriptions, User
+
+MEDIA_ROOT = tempfile.mkdtemp()
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+SERVER_TIMING_DURATIONS = re.compile(r'(\w+);dur=([\d.]+)')
+
+
+def make_image():
+    buffer = io.BytesIO()
+    Image.new('RGB', (2, 2)).save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+def get_statements(queries):
+    return [
+        query['sql'] for query in queries
+        if not query['sql'].startswith(('SAVEPOINT', 'RELEASE', 'ROLLBACK'))
+    ]
+
+
+def get_writes(queries, table):
+    return [
+        query['sql'] for query in queries
+        if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+        and f'"{table}"' in query['sql'].split(' WHERE ')[0]
+    ]
+
+
+class APITestMixin:
+
+    @classmethod
+    def create_data(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass',
+            first_name='Автор', last_name='Рецептов',
+        )
+        cls.user = User.objects.create_user(
+            username='user', email='user@example.com', password='pass',
+            first_name='Читатель', last_name='Рецептов',
+        )
+        cls.tags = [
+            Tag.objects.create(name=name, color=color, slug=slug)
+            for name, color, slug in (
+                ('Завтрак', '#E26C2D', 'breakfast'),
+                ('Обед', '#49B64E', 'lunch'),
+            )
+        ]
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {index}', measurement_unit='г')
+            for index in range(5)
+        )
+        cls.ingredients = list(Ingredient.objects.order_by('pk'))
+        cls.recipe = cls.create_recipe(
+            cls.author, 'Каша', cls.ingredients[:3]
+        )
+
+    @classmethod
+    def create_recipe(cls, author, name, ingredients, amount=100):
+        recipe = Recipe.objects.create(
+            author=author, name=name, image='recipes/test.png',
+            text='Описание', cooking_time=10,
+        )
+        recipe.tags.set(cls.tags[:1])
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                             amount=amount)
+            for ingredient in ingredients
+        )
+        return recipe
+
+    def setUp(self):
+        cache.clear()
+        for target, value in (
+            ('api.images.get_executor', lambda: SimpleNamespace(
+                submit=lambda func, *args: func(*args)
+            )),
+            ('api.images.close_old_connections', lambda: None),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def use_shared_cache(self):
+        patcher = mock.patch(
+            'api.authentication.is_shared_cache', return_value=True
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_payload(self, **changes):
+        payload = {
+            'name': self.recipe.name,
+            'text': self.recipe.text,
+            'cooking_time': self.recipe.cooking_time,
+            'image': make_image(),
+            'tags': [tag.pk for tag in self.tags[:1]],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': 100}
+                for ingredient in self.ingredients[:3]
+            ],
+        }
+        payload.update(changes)
+        return payload
+
+    def assertWithinBudget(self, response):
+        endpoint = get_endpoint(
+            response.resolver_match.func,
+            response.request['REQUEST_METHOD'].lower(),
+        )
+        self.assertIn(endpoint, settings.QUERY_BUDGETS)
+        queries = int(SERVER_TIMING_QUERIES.search(
+            response['Server-Timing']
+        ).group(1))
+        self.assertLessEqual(
+            queries,
+            settings.QUERY_BUDGETS[endpoint],
+            f'{endpoint}: {queries} SQL-запросов при бюджете '
+            f'{settings.QUERY_BUDGETS[endpoint]}',
+        )
+        return queries
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class APITestBase(APITestMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_data()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+
+class RecipeUpdateQueriesTest(APITestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.author)
+        self.url = f'/api/recipes/{self.recipe.pk}/'
+
+    def patch(self, queries, **changes):
+        with self.assertNumQueries(queries):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.patch(
+                    self.url, self.get_payload(**changes), format='json'
+                )
+        self.assertEqual(response.status_code, 200, response.data)
+        return response, context.captured_queries
+
+    def test_title_only(self):
+        response, queries = self.patch(9, name='Овсяная каша')
+        self.assertEqual(response.data['name'], 'Овсяная каша')
+        [update] = get_writes(queries, 'recipes_recipe')
+        self.assertNotIn('"favorites_count"', update)
+        self.assertNotIn('"text"', update)
+        self.assertFalse(get_writes(queries, 'recipes_recipeingredient'))
+        self.assertFalse(get_writes(queries, 'recipes_recipe_tags'))
+
+    def test_amount_change(self):
+        ingredients = [
+            {'id': ingredient.pk, 'amount': 100}
+            for ingredient in self.ingredients[:3]
+        ]
+        ingredients[0]['amount'] = 250
+        response, queries = self.patch(10, ingredients=ingredients)
+        self.assertEqual(
+            [item['amount'] for item in response.data['ingredients']],
+            [250, 100, 100],
+        )
+        [update] = get_writes(queries, 'recipes_recipeingredient')
+        self.assertTrue(update.startswith('UPDATE'))
+
+    def test_remove_one_ingredient(self):
+        ingredients = [
+            {'id': ingredient.pk, 'amount': 100}
+            for ingredient in self.ingredients[:2]
+        ]
+        response, queries = self.patch(10, ingredients=ingredients)
+        self.assertEqual(
+            [item['id'] for item in response.data['ingredients']],
+            [ingredient.pk for ingredient in self.ingredients[:2]],
+        )
+        [delete] = get_writes(queries, 'recipes_recipeingredient')
+        self.assertTrue(delete.startswith('DELETE'))
+        self.assertFalse(RecipeIngredient.objects.filter(
+            recipe=self.recipe, ingredient=self.ingredients[2]
+        ).exists())
+
+    def test_counters_survive_stale_instance(self):
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        Recipe.objects.filter(pk=recipe.pk).update(
+            favorites_count=3, cart_count=2
+        )
+        serializer = RecipeCreateSerializer(
+            recipe, data=self.get_payload(name='Каша на молоке')
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.assertEqual(
+            Recipe.objects.values_list(
+                'name', 'favorites_count', 'cart_count'
+            ).get(pk=recipe.pk),
+            ('Каша на молоке', 3, 2),
+        )
+
+
+class RecipeCreateQueriesTest(APITestBase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Специя {index}', measurement_unit='г')
+            for index in range(45)
+        )
+        cls.many = list(
+            Ingredient.objects.filter(name__startswith='Специя')
+            .order_by('pk').values_list('pk', flat=True)
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.author)
+
+    def post(self, ingredient_ids, tags=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/api/recipes/', self.get_payload(
+                name='Плов',
+                ingredients=[
+                    {'id': pk, 'amount': 10} for pk in ingredient_ids
+                ],
+                tags=tags or [self.tags[0].pk],
+            ), format='json')
+        return response, context.captured_queries
+
+    def test_query_count_does_not_grow(self):
+        self.post(self.many[:3])
+        response, queries = self.post(self.many[:3])
+        self.assertEqual(response.status_code, 201, response.data)
+        with self.assertNumQueries(len(queries)):
+            response, queries = self.post(self.many)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(response.data['ingredients']), 45)
+        self.assertEqual(
+            len(get_writes(queries, 'recipes_recipeingredient')), 1
+        )
+
+    def test_duplicate_and_missing_ids(self):
+        ids = self.many[:40] + [self.many[7], self.many[3], self.many[7]]
+        ids += [0, 999999]
+        missing_tag = Tag.objects.order_by('-pk')[0].pk + 1
+        with self.assertNumQueries(2):
+            response, _ = self.post(
+                ids, [self.tags[1].pk, self.tags[1].pk, missing_tag]
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['ingredients'], [
+            f'Ингредиенты не могут повторяться: '
+            f'{self.many[3]}, {self.many[7]}.',
+            'Ингредиенты не найдены: 0, 999999.',
+        ])
+        self.assertEqual(response.data['tags'], [
+            f'Теги не могут повторяться: {self.tags[1].pk}.',
+            f'Теги не найдены: {missing_tag}.',
+        ])
+        self.assertFalse(Recipe.objects.filter(name='Плов'))
+
+    def test_only_duplicates(self):
+        response, _ = self.post(self.many[:41] + self.many[:1])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['ingredients'], [
+            f'Ингредиенты не могут повторяться: {self.many[0]}.',
+        ])
+        self.assertNotIn('tags', response.data)
+
+
+class TimelineQueriesTest(APITestBase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.popular = User.objects.create_user(
+            username='popular', email='popular@example.com', password='pass',
+            timeline_pull=True,
+        )
+        for index in range(4):
+            for author in (cls.author, cls.popular):
+                cls.create_recipe(
+                    author, f'Рецепт {index}', cls.ingredients[:2]
+                )
+        for author in (cls.author, cls.popular):
+            Subscriptions.objects.create(user=cls.user, author=author)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def test_cold_and_warm_requests(self):
+        url = '/api/users/timeline/?limit=3'
+        with self.assertNumQueries(
+            settings.QUERY_BUDGETS['CustomUserViewSet.timeline'] - 1
+        ):
+            response = self.client.get(url)
+        with self.assertNumQueries(5):
+            self.client.get(url)
+        ids = []
+        while url:
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+            response = url and self.client.get(url)
+        self.assertEqual(ids, list(
+            Recipe.objects.order_by('-pub_date', '-id')
+            .values_list('pk', flat=True)
+        ))
+
+
+class TimelineTest(APITestBase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.popular = User.objects.create_user(
+            username='popular', email='popular@example.com', password='pass',
+            timeline_pull=True,
+        )
+        for index in range(3):
+            for author in (cls.author, cls.popular):
+                cls.create_recipe(
+                    author, f'Рецепт {index}', cls.ingredients[:1]
+                )
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def get_entries(self):
+        return list(
+            TimelineEntry.objects.filter(user=self.user)
+            .order_by('-pub_date', '-recipe_id')
+            .values_list('recipe_id', flat=True)
+        )
+
+    def get_timeline(self):
+        response = self.client.get('/api/users/timeline/?limit=20')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def get_recipes(self, *authors):
+        return list(
+            Recipe.objects.filter(author__in=authors)
+            .order_by('-pub_date', '-id').values_list('pk', flat=True)
+        )
+
+    def subscribe(self, author, method='post'):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(
+                f'/api/users/{author.pk}/subscribe/'
+            )
+        self.assertIn(response.status_code, (201, 204), response.data)
+
+    def publish(self, author):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.create_recipe(author, 'Суп', self.ingredients[:1])
+
+    @override_settings(TIMELINE_BACKFILL_LIMIT=2)
+    def test_subscribe_backfills_latest_recipes(self):
+        self.subscribe(self.author)
+        self.assertEqual(self.get_entries(), self.get_recipes(self.author)[:2])
+        recipe = self.publish(self.author)
+        self.assertEqual(self.get_entries()[0], recipe.pk)
+
+    def test_unsubscribe_clears_only_author_entries(self):
+        other = User.objects.create_user(
+            username='other', email='other@example.com', password='pass',
+        )
+        recipe = self.publish(other)
+        self.subscribe(self.author)
+        self.subscribe(other)
+        self.subscribe(self.author, 'delete')
+        self.assertEqual(self.get_entries(), [recipe.pk])
+        self.assertEqual(self.get_timeline(), [recipe.pk])
+
+    def test_pull_author_is_read_at_request_time(self):
+        self.subscribe(self.author)
+        self.subscribe(self.popular)
+        self.assertEqual(self.get_entries(), self.get_recipes(self.author))
+        recipe = self.publish(self.popular)
+        self.assertFalse(TimelineEntry.objects.filter(recipe=recipe))
+        self.assertEqual(
+            self.get_timeline(), self.get_recipes(self.author, self.popular)
+        )
+        self.subscribe(self.popular, 'delete')
+        self.assertEqual(self.get_timeline(), self.get_recipes(self.author))
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_author_over_fanout_limit_switches_to_pull(self):
+        self.subscribe(self.author)
+        recipe = self.publish(self.author)
+        self.assertTrue(
+            User.objects.filter(pk=self.author.pk, timeline_pull=True)
+        )
+        self.assertFalse(TimelineEntry.objects.filter(recipe=recipe))
+        self.assertEqual(self.get_timeline(), self.get_recipes(self.author))
+
+
+class SubscriptionsRecipesLimitTest(APITestBase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.authors = [cls.author] + [
+            User.objects.create_user(
+                username=f'author{index}',
+                email=f'author{index}@example.com',
+                password='pass',
+            )
+            for index in range(2)
+        ]
+        for author in cls.authors:
+            for index in range(4):
+                cls.create_recipe(
+                    author, f'Рецепт {index}', cls.ingredients[:1]
+                )
+        for author in cls.authors[:2]:
+            Subscriptions.objects.create(user=cls.user, author=author)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def get_subscriptions(self, query=''):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'/api/users/subscriptions/{query}')
+        return response, len(context.captured_queries)
+
+    def test_recipes_truncated_per_author(self):
+        response, _ = self.get_subscriptions('?recipes_limit=2')
+        self.assertEqual(response.status_code, 200, response.data)
+        for data in response.data['results']:
+            recipes = Recipe.objects.filter(author_id=data['id'])
+            self.assertEqual(
+                [recipe['id'] for recipe in data['recipes']],
+                list(recipes.values_list('pk', flat=True)[:2]),
+            )
+            self.assertEqual(data['recipes_count'], recipes.count())
+
+    def test_query_count_does_not_depend_on_authors(self):
+        _, queries = self.get_subscriptions('?recipes_limit=2')
+        Subscriptions.objects.create(user=self.user, author=self.authors[2])
+        with self.assertNumQueries(queries):
+            response = self.client.get(
+                '/api/users/subscriptions/?recipes_limit=2'
+            )
+        self.assertEqual(len(response.data['results']), 3)
+        _, unlimited = self.get_subscriptions()
+        self.assertEqual(queries, unlimited)
+
+    def test_zero_limit(self):
+        response, queries = self.get_subscriptions('?recipes_limit=0')
+        self.assertEqual(response.status_code, 200, response.data)
+        for data in response.data['results']:
+            self.assertEqual(data['recipes'], [])
+            self.assertGreater(data['recipes_count'], 0)
+        _, unlimited = self.get_subscriptions()
+        self.assertEqual(queries, unlimited - 1)
+
+    def test_invalid_limit(self):
+        for value, message in (
+            ('-1', 'Значение не может быть отрицательным.'),
+            ('abc', 'Значение должно быть целым числом.'),
+            ('1.5', 'Значение должно быть целым числом.'),
+        ):
+            with self.subTest(value=value):
+                response, _ = self.get_subscriptions(
+                    f'?recipes_limit={value}'
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.data['recipes_limit'], message)
+
+    def test_subscribe_respects_limit(self):
+        author = self.authors[2]
+        response = self.client.post(
+            f'/api/users/{author.pk}/subscribe/?recipes_limit=1'
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(response.data['recipes']), 1)
+        self.assertEqual(response.data['recipes_count'], 4)
+
+
+class ShoppingCartDownloadTest(APITestBase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        second = cls.create_recipe(
+            cls.author, 'Суп', cls.ingredients[1:4], amount=50
+        )
+        Shopping_cart.objects.bulk_create(
+            Shopping_cart(user=cls.user, recipe=recipe)
+            for recipe in (cls.recipe, second)
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def test_single_grouped_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                '/api/recipes/download_shopping_cart/'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            b''.join(response.streaming_content).decode().splitlines()[1:],
+            [
+                'Ингредиент 0 - 100г',
+                'Ингредиент 1 - 150г',
+                'Ингредиент 2 - 150г',
+                'Ингредиент 3 - 50г',
+            ],
+        )
+
+    def download(self, export_format):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/', {'format': export_format}
+        )
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_csv(self):
+        content = self.download('csv').decode('utf-8-sig')
+        self.assertEqual(
+            list(csv.reader(io.StringIO(content))),
+            [
+                ['Ингредиент', 'Количество', 'Единица'],
+                ['Ингредиент 0', '100', 'г'],
+                ['Ингредиент 1', '150', 'г'],
+                ['Ингредиент 2', '150', 'г'],
+                ['Ингредиент 3', '50', 'г'],
+            ],
+        )
+
+    def test_pdf(self):
+        content = self.download('pdf')
+        self.assertTrue(content.startswith(b'%PDF-'))
+        self.assertTrue(content.rstrip().endswith(b'%%EOF'))
+        self.assertIn(b'/Subtype /TrueType', content)
+        self.assertNotIn(b'/Subtype /Image', content)
+        self.assertIn(b'/Count 1', content)
+
+    def test_pdf_pages(self):
+        items = [(f'Ингредиент {index}', '1', 'г') for index in range(100)]
+        content = b''.join(export_pdf(items))
+        self.assertIn(b'/Count 3', content)
+
+
+class NormalizeShoppingListTest(SimpleTestCase):
+
+    def test_units(self):
+        self.assertEqual(
+            normalize_shopping_list([
+                {'name': 'Мука', 'measurement_unit': 'кг', 'amount': 1},
+                {'name': 'Мука', 'measurement_unit': 'г', 'amount': 500},
+                {'name': 'Молоко', 'measurement_unit': 'л', 'amount': 2},
+                {'name': 'Молоко', 'measurement_unit': 'мл', 'amount': 300},
+                {'name': 'Сахар', 'measurement_unit': 'кг', 'amount': 0},
+                {'name': 'Соль', 'measurement_unit': 'г', 'amount': 5},
+            ]),
+            [
+                ('Молоко', '2.3', 'л'),
+                ('Мука', '1.5', 'кг'),
+                ('Сахар', '0', 'г'),
+                ('Соль', '5', 'г'),
+            ],
+        )
+
+    def test_mixed_units_are_not_merged(self):
+        self.assertEqual(
+            normalize_shopping_list([
+                {'name': 'Яйца', 'measurement_unit': 'шт.', 'amount': 3},
+                {'name': 'Яйца', 'measurement_unit': 'г', 'amount': 120},
+                {'name': 'Яйца', 'measurement_unit': 'кг', 'amount': 1},
+                {'name': 'Вода', 'measurement_unit': 'л', 'amount': 1},
+                {'name': 'Вода', 'measurement_unit': 'г', 'amount': 200},
+            ]),
+            [
+                ('Вода', '200', 'г'),
+                ('Вода', '1', 'л'),
+                ('Яйца', '1.12', 'кг'),
+                ('Яйца', '3', 'шт.'),
+            ],
+        )
+
+
+class QueryBudgetTest(APITestBase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Subscriptions.objects.create(user=cls.user, author=cls.author)
+        Shopping_cart.objects.create(user=cls.user, recipe=cls.recipe)
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        super().setUp()
+        self.use_shared_cache()
+        pantry_index.rebuild()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def test_endpoints_within_budget(self):
+        ingredients = '&'.join(
+            f'ingredients={ingredient.pk}'
+            for ingredient in self.ingredients[:2]
+        )
+        for url in (
+            '/api/recipes/',
+            f'/api/recipes/{self.recipe.pk}/',
+            '/api/recipes/download_shopping_cart/',
+            f'/api/recipes/pantry/?{ingredients}',
+            f'/api/recipes/{self.recipe.pk}/similar/',
+            '/api/users/',
+            '/api/users/subscriptions/',
+            '/api/users/timeline/',
+            '/api/tags/',
+            '/api/ingredients/',
+        ):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertWithinBudget(response)
+
+    def test_server_timing_reports_serialization(self):
+        to_representation = RecipeListSerializer.to_representation
+
+        def slow_to_representation(serializer, instance):
+            time.sleep(0.05)
+            return to_representation(serializer, instance)
+
+        with mock.patch.object(
+            RecipeListSerializer, 'to_representation',
+            slow_to_representation,
+        ):
+            response = self.client.get('/api/users/subscriptions/')
+        timings = {
+            name: float(duration) for name, duration in
+            SERVER_TIMING_DURATIONS.findall(response['Server-Timing'])
+        }
+        self.assertGreaterEqual(timings['serialize'], 50)
+        self.assertLess(timings['view'], timings['serialize'])
+        self.assertLessEqual(
+            timings['view'] + timings['serialize'] + timings['render'],
+            timings['total'] + 0.1,
+        )
+        self.assertIn(
+            'max_serialize_time',
+            endpoint_stats.snapshot()['CustomUserViewSet.subscriptions'],
+        )
+
+    @override_settings(
+        QUERY_BUDGET_STRICT=True, QUERY_BUDGETS={'TagViewsSet.list': 0}
+    )
+    def test_strict_mode_raises(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get('/api/tags/')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class AsyncQueryBudgetTest(APITestMixin, APITransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_data()
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+
+    def test_endpoints_within_budget(self):
+        for url in (
+            '/api/async/recipes/',
+            f'/api/async/recipes/{self.recipe.pk}/',
+            '/api/async/tags/',
+            '/api/async/ingredients/',
+        ):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertWithinBudget(response)
+
+    def test_matches_sync_endpoints(self):
+        self.create_recipe(self.author, 'Суп', self.ingredients[1:])
+        for url in (
+            'recipes/?limit=1',
+            'recipes/?limit=1&cursor=',
+            'recipes/?limit=1&skip_count=1&page=2',
+            'recipes/?ordering=popular&cursor=',
+            'recipes/?tags=breakfast&is_favorited=0',
+            'recipes/?search=каша',
+            'recipes/?cursor=broken',
+            f'recipes/{self.recipe.pk}/',
+            'recipes/0/',
+            'ingredients/?name=инг',
+            'tags/',
+        ):
+            with self.subTest(url=url):
+                expected = self.client.get(f'/api/{url}')
+                response = self.client.get(f'/api/async/{url}')
+                self.assertEqual(
+                    response.status_code, expected.status_code
+                )
+                self.assertEqual(
+                    response.content.replace(b'/api/async/', b'/api/'),
+                    expected.content,
+                )
+
+    def test_reuses_viewset_behaviour(self):
+        response = self.client.post('/api/async/tags/')
+        self.assertEqual(response.status_code, 405)
+        etag = self.client.get('/api/async/tags/')['ETag']
+        response = self.client.get(
+            '/api/async/tags/', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 304)
+        self.client.credentials(HTTP_AUTHORIZATION='Token invalid')
+        response = self.client.get('/api/async/recipes/')
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ConcurrentToggleTest(APITestMixin, APITransactionTestCase):
+    workers = 8
+    rounds = 5
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('SQLite в памяти не допускает конкурентную запись.')
+        super().setUp()
+        self.create_data()
+        self.users = [
+            User.objects.create_user(
+                username=f'user{index}', email=f'user{index}@example.com',
+                password='pass',
+            )
+            for index in range(self.workers)
+        ]
+
+    def run_threads(self, func, args):
+        def call(arg):
+            try:
+                return func(arg)
+            finally:
+                connection.close()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(call, args))
+
+    def request(self, user, method, url):
+        client = APIClient()
+        client.force_authenticate(user)
+        return getattr(client, method)(url).status_code
+
+    def test_toggles_keep_counters_consistent(self):
+        for name, model, counter in (
+            ('favorite', Favorites, 'favorites_count'),
+            ('shopping_cart', Shopping_cart, 'cart_count'),
+        ):
+            url = f'/api/recipes/{self.recipe.pk}/{name}/'
+
+            def toggle(user):
+                return [
+                    self.request(user, method, url)
+                    for _ in range(self.rounds)
+                    for method in ('post', 'delete')
+                ] + [self.request(user, 'post', url)]
+
+            with self.subTest(relation=name):
+                for statuses in self.run_threads(toggle, self.users):
+                    self.assertEqual(
+                        statuses, [201, 204] * self.rounds + [201]
+                    )
+                self.assertEqual(
+                    getattr(Recipe.objects.get(pk=self.recipe.pk), counter),
+                    model.objects.filter(recipe=self.recipe).count(),
+                )
+                self.assertEqual(
+                    model.objects.filter(recipe=self.recipe).count(),
+                    self.workers,
+                )
+
+    def test_duplicate_requests_create_one_row(self):
+        url = f'/api/recipes/{self.recipe.pk}/favorite/'
+        statuses = self.run_threads(
+            lambda _: self.request(self.user, 'post', url),
+            range(self.workers),
+        )
+        self.assertEqual(sorted(statuses), [201] + [400] * (self.workers - 1))
+        self.assertEqual(
+            Recipe.objects.get(pk=self.recipe.pk).favorites_count, 1
+        )
+
+    def test_concurrent_subscribe(self):
+        url = f'/api/users/{self.author.pk}/subscribe/'
+        statuses = self.run_threads(
+            lambda user: self.request(user, 'post', url), self.users
+        )
+        self.assertEqual(statuses, [201] * self.workers)
+        self.assertEqual(
+            Subscriptions.objects.filter(author=self.author).count(),
+            self.workers,
+        )
+
+
+class QueryPlanTest(APITestBase):
+    keyset_patterns = {
+        'postgresql': r'Index Cond: \(.*pub_date <=',
+        'sqlite': r'SEARCH recipes_recipe USING INDEX \w+ \(pub_date<\?\)',
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        recipes = [
+            cls.create_recipe(cls.author, f'Рецепт {index}', cls.ingredients)
+            for index in range(10)
+        ]
+        Favorites.objects.bulk_create(
+            Favorites(user=cls.user, recipe=recipe) for recipe in recipes
+        )
+        Shopping_cart.objects.bulk_create(
+            Shopping_cart(user=cls.user, recipe=recipe)
+            for recipe in recipes[:3]
+        )
+        Subscriptions.objects.create(user=cls.user, author=cls.author)
+
+    def explain(self, queryset):
+        with transaction.atomic():
+            disable_seq_scan()
+            plan = queryset.explain()
+            transaction.set_rollback(True)
+        return plan
+
+    def test_hot_queries_use_indexes(self):
+        for title, queryset, models, ordered in get_checks(
+            self.user, self.author.pk, [tag.slug for tag in self.tags]
+        ):
+            with self.subTest(check=title):
+                plan = self.explain(queryset)
+                self.assertEqual(
+                    get_plan_problems(plan, models, ordered), [], plan
+                )
+
+    def test_keyset_page_bounds_leading_column(self):
+        ordering = ('-pub_date', '-id')
+        recipes = Recipe.objects.order_by(*ordering)
+        position = list(recipes.values_list('pub_date', 'id')[5])
+        plan = self.explain(recipes.filter(
+            get_position_filter(ordering, position)
+        )[:6])
+        self.assertRegex(plan, self.keyset_patterns[connection.vendor])
+
+
+class CursorPaginationTest(APITestBase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        recipes = [cls.recipe] + [
+            cls.create_recipe(cls.author, f'Рецепт {index}', cls.ingredients)
+            for index in range(6)
+        ]
+        now = timezone.now()
+        for index, recipe in enumerate(recipes):
+            Recipe.objects.filter(pk=recipe.pk).update(
+                pub_date=now - datetime.timedelta(hours=index // 3),
+                favorites_count=index % 2,
+            )
+
+    def walk(self, url):
+        ids = []
+        pages = 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+            pages += 1
+        return ids, pages
+
+    def ordered_ids(self, *ordering):
+        return list(
+            Recipe.objects.order_by(*ordering).values_list('pk', flat=True)
+        )
+
+    def test_round_trip_with_ties(self):
+        ids, pages = self.walk('/api/recipes/?cursor=&limit=2')
+        self.assertEqual(ids, self.ordered_ids('-pub_date', '-id'))
+        self.assertEqual(pages, 4)
+
+    def test_popular_ordering(self):
+        ids, _ = self.walk('/api/recipes/?cursor=&limit=2&ordering=popular')
+        self.assertEqual(ids, self.ordered_ids(*POPULAR_ORDERING))
+
+    def test_skip_count(self):
+        response = self.client.get('/api/recipes/?skip_count=1&limit=3')
+        self.assertIsNone(response.data['count'])
+        self.assertIsNone(response.data['previous'])
+        self.assertIn('page=2', response.data['next'])
+        ids, pages = self.walk('/api/recipes/?skip_count=1&limit=3')
+        self.assertEqual(ids, self.ordered_ids('-pub_date', '-id'))
+        self.assertEqual(pages, 3)
+        response = self.client.get('/api/recipes/?cursor=&skip_count=1')
+        self.assertIsNone(response.data['count'])
+
+    def test_malformed_cursor(self):
+        for values in (
+            ['abc', 1],
+            [{'x': 1}, 1],
+            [timezone.now().isoformat(), 'abc'],
+            [timezone.now().isoformat(), True],
+            [timezone.now().isoformat(), 2 ** 64],
+            ['2024-01-01T00:00:00', 1],
+            [timezone.now().isoformat()],
+            {'pub_date': 1},
+        ):
+            with self.subTest(values=values):
+                response = self.client.get(
+                    '/api/recipes/', {'cursor': encode_cursor(values)}
+                )
+                self.assertEqual(response.status_code, 404)
+        for cursor in ('не base64', 'bm90IGpzb24=', '%%%'):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(
+                    '/api/recipes/', {'cursor': cursor}
+                )
+                self.assertEqual(response.status_code, 404)
+
+    def test_decode_cursor_coerces_values(self):
+        pub_date = timezone.now()
+        self.assertEqual(
+            decode_cursor(
+                encode_cursor([3, pub_date, 7]), POPULAR_ORDERING
+            ),
+            [3, pub_date, 7],
+        )
+
+
+class RecipeListCacheTest(APITestBase):
+    url = '/api/recipes/'
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Favorites.objects.create(user=cls.user, recipe=cls.recipe)
+
+    def get_flags(self, user=None):
+        self.client.force_authenticate(user)
+        [recipe] = self.client.get(self.url).data['results']
+        return recipe['is_favorited'], recipe['author']['is_subscribed']
+
+    def test_recipe_write_bumps_version(self):
+        self.client.get(self.url)
+        version = get_version('recipes')
+        self.client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/recipes/{self.recipe.pk}/',
+                self.get_payload(name='Новая каша'),
+                format='json',
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(get_version('recipes'), version)
+        [recipe] = self.client.get(self.url).data['results']
+        self.assertEqual(recipe['name'], 'Новая каша')
+
+    def test_favorite_toggle_keeps_shared_pages(self):
+        self.client.force_authenticate(self.author)
+        self.client.get(self.url)
+        version = get_version('recipes')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f'/api/recipes/{self.recipe.pk}/favorite/'
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(get_version('recipes'), version)
+        with self.assertNumQueries(3):
+            [recipe] = self.client.get(self.url).data['results']
+        self.assertTrue(recipe['is_favorited'])
+
+    def test_flags_are_per_user(self):
+        Subscriptions.objects.create(user=self.user, author=self.author)
+        self.assertEqual(self.get_flags(self.user), (True, True))
+        with self.assertNumQueries(3):
+            self.assertEqual(self.get_flags(self.author), (False, False))
+        self.assertEqual(self.get_flags(), (False, False))
+        self.assertEqual(self.get_flags(self.user), (True, True))
+
+
+class TokenAuthenticationTest(APITestBase):
+    url = '/api/users/me/'
+
+    def setUp(self):
+        super().setUp()
+        token_cache._data.clear()
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def assertRejected(self):
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def warm_up(self):
+        self.use_shared_cache()
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_logout(self):
+        self.warm_up()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertRejected()
+
+    def test_deactivation_by_save(self):
+        self.warm_up()
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertRejected()
+
+    def test_deactivation_by_update(self):
+        self.warm_up()
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertRejected()
+
+    def test_token_deletion(self):
+        self.warm_up()
+        with self.captureOnCommitCallbacks(execute=True):
+            Token.objects.filter(user=self.user).delete()
+        self.assertRejected()
+
+    def test_local_cache_checks_database(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertRejected()
+
+
+class RankMatchesTest(SimpleTestCase):
+
+    def setUp(self):
+        self.postings, self.totals = build_index(
+            [(1, 10), (1, 11), (2, 10), (2, 12), (2, 13), (3, 11)], 3
+        )
+
+    def rank(self, pantry, max_missing, overlay=None):
+        return rank_matches(
+            self.postings, self.totals, overlay or {}, pantry, max_missing
+        )
+
+    def test_build_index(self):
+        self.assertEqual(
+            {pk: list(posting) for pk, posting in self.postings.items()},
+            {10: [1, 2], 11: [1, 3], 12: [2], 13: [2]},
+        )
+        self.assertEqual(list(self.totals), [0, 2, 3, 1])
+
+    def test_fully_cookable_only(self):
+        self.assertEqual(self.rank([10, 11], 0), [(3, 0), (1, 0)])
+
+    def test_missing_ingredients(self):
+        self.assertEqual(self.rank([10, 11], 2), [(3, 0), (1, 0), (2, 2)])
+        self.assertEqual(self.rank([12], 1), [])
+        self.assertEqual(self.rank([99], 5), [])
+
+    def test_overlay_replaces_indexed_recipe(self):
+        overlay = {2: {10, 11}, 3: set(), 4: {11}}
+        self.assertEqual(
+            self.rank([10, 11], 0, overlay), [(4, 0), (2, 0), (1, 0)]
+        )
+
+
+class PantryIndexTest(APITestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.index = PantryIndex()
+        patcher = mock.patch.object(self.index, 'start_rebuild')
+        self.start_rebuild = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pantry = [ingredient.pk for ingredient in self.ingredients[:2]]
+
+    def test_cold_index_falls_back_to_database(self):
+        self.assertEqual(
+            self.index.match(self.pantry, 1), [(self.recipe.pk, 1)]
+        )
+        self.start_rebuild.assert_called_once()
+        self.index.rebuild()
+        self.assertEqual(
+            self.index.match(self.pantry, 1),
+            match_in_database(self.pantry, 1),
+        )
+
+    def test_stale_index_is_served_while_rebuilding(self):
+        self.index.rebuild()
+        self.index.invalidate()
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.index.match(self.pantry, 1), [(self.recipe.pk, 1)]
+            )
+        self.start_rebuild.assert_called_once()
+
+    def test_recipe_edit_updates_overlay(self):
+        pantry_index.rebuild()
+        self.client.force_authenticate(self.author)
+        url = '/api/recipes/pantry/?' + '&'.join(
+            f'ingredients={pk}' for pk in self.pantry
+        )
+        [recipe] = self.client.get(url).data['results']
+        self.assertEqual(recipe['missing_count'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                f'/api/recipes/{self.recipe.pk}/',
+                self.get_payload(ingredients=[
+                    {'id': pk, 'amount': 100} for pk in self.pantry
+                ]),
+                format='json',
+            )
+        with self.assertNumQueries(3):
+            [recipe] = self.client.get(url).data['results']
+        self.assertEqual(recipe['missing_count'], 0)
+        self.assertEqual(pantry_index._data[2], {
+            self.recipe.pk: set(self.pantry)
+        })
+
+
+class ImageVariantsTest(APITestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.author)
+
+    def upload(self, method, url, **changes):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(
+                url, self.get_payload(**changes), format='json'
+            )
+        self.assertIn(response.status_code, (200, 201), response.data)
+        return Recipe.objects.get(pk=response.data.get('id', self.recipe.pk))
+
+    def get_files(self, recipe):
+        return [recipe.image.name, *recipe.image_variants.values()]
+
+    def test_manifest_is_served_without_storage_lookups(self):
+        recipe = self.upload('post', '/api/recipes/')
+        self.assertEqual(
+            set(recipe.image_variants), set(settings.RECIPE_IMAGE_VARIANTS)
+        )
+        for name in self.get_files(recipe):
+            self.assertTrue(default_storage.exists(name), name)
+        with mock.patch.object(default_storage, 'exists') as exists:
+            response = self.client.get(f'/api/recipes/{recipe.pk}/')
+        exists.assert_not_called()
+        self.assertEqual(
+            response.data['image_variants']['thumbnail'],
+            'http://testserver' + default_storage.url(
+                recipe.image_variants['thumbnail']
+            ),
+        )
+
+    def test_replaced_image_files_are_deleted(self):
+        recipe = self.upload('post', '/api/recipes/')
+        self.recipe = recipe
+        old_files = self.get_files(recipe)
+        recipe = self.upload('patch', f'/api/recipes/{recipe.pk}/')
+        new_files = self.get_files(recipe)
+        self.assertEqual(len(new_files), 4)
+        for name in old_files:
+            self.assertFalse(default_storage.exists(name), name)
+        for name in new_files:
+            self.assertTrue(default_storage.exists(name), name)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/recipes/{recipe.pk}/')
+        for name in new_files:
+            self.assertFalse(default_storage.exists(name), name)
+
+    def test_shared_image_is_kept(self):
+        recipe = self.upload('post', '/api/recipes/')
+        twin = Recipe.objects.create(
+            author=self.author, name='Копия', image=recipe.image.name,
+            image_variants=recipe.image_variants, text='Описание',
+            cooking_time=5,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        for name in self.get_files(twin):
+            self.assertTrue(default_storage.exists(name), name)
+
+
+class SearchTest(APITestBase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        beet = Ingredient.objects.create(
+            name='Свёкла', measurement_unit='г'
+        )
+        cls.borscht = cls.create_recipe(
+            cls.author, 'Красный борщ', [beet, cls.ingredients[0]]
+        )
+        cls.soup = Recipe.objects.create(
+            author=cls.author, name='Суп дня', image='recipes/test.png',
+            text='Почти как борщ, только свекла другая.', cooking_time=30,
+        )
+        update_search_vectors(Recipe.objects.all())
+
+    def search(self, value):
+        response = self.client.get('/api/recipes/', {'search': value})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['name'] for recipe in response.data['results']]
+
+    def test_name_match_ranks_first(self):
+        self.assertEqual(self.search('борщ'), ['Красный борщ', 'Суп дня'])
+        self.assertEqual(self.search('свекла'), ['Красный борщ', 'Суп дня'])
+
+    def test_case_and_yo_insensitive(self):
+        for value in ('БОРЩ', 'Борщ', 'СВЁКЛА', 'свекла', 'КРАСНЫЙ'):
+            self.assertIn('Красный борщ', self.search(value), value)
+        self.assertEqual(self.search('каша'), ['Каша'])
+
+    def test_websearch_syntax(self):
+        for value, expected in (
+            ('"овсяная каша" -молоко', ('"овсяная каша"', '"молоко"*')),
+            ('суп or щи -мясо -рыба', (
+                '("суп"* OR "щи"*)', '"мясо"* OR "рыба"*'
+            )),
+            ('Борщ  свёкла', ('"борщ"* AND "свекла"*', None)),
+            ('-молоко', (None, '"молоко"*')),
+            ('""', (None, None)),
+        ):
+            self.assertEqual(get_fts_query(value), expected, value)
+        self.assertEqual(self.search('"красный борщ"'), ['Красный борщ'])
+        self.assertEqual(self.search('"борщ красный"'), [])
+        self.assertEqual(self.search('борщ -красный'), ['Суп дня'])
+        self.assertEqual(
+            self.search('каша or суп'), ['Суп дня', 'Каша']
+        )
+        self.assertEqual(self.search('-борщ'), ['Каша'])
+
+    def test_postgres_uses_websearch_query(self):
+        with mock.patch('api.search.connection') as patched:
+            patched.vendor = 'postgresql'
+            queryset = search_recipes(
+                Recipe.objects.all(), '"красный борщ" -сметана'
+            )
+        sql = str(queryset.query)
+        self.assertIn('websearch_to_tsquery', sql)
+        self.assertIn('ts_rank', sql)
+        self.assertNotIn(FTS_TABLE, sql)
+
+    def test_ingredient_change_refreshes_index(self):
+        self.client.force_authenticate(self.author)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.search('свекла'), ['Красный борщ', 'Суп дня'])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/recipes/{self.recipe.pk}/',
+                self.get_payload(ingredients=[
+                    {'id': self.borscht.ingredients.get(
+                        name='Свёкла'
+                    ).pk, 'amount': 50},
+                ]),
+                format='json',
+            )
+        self.assertEqual(response.status_code, 200)
+        names = self.search('свекла')
+        self.assertCountEqual(names, ['Красный борщ', 'Каша', 'Суп дня'])
+        self.assertEqual(names[-1], 'Суп дня')
+        self.assertNotIn('Каша', self.search('ингредиент'))
+
+    def test_deleted_recipe_leaves_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Таблица FTS5 есть только в SQLite.')
+        query = f'SELECT rowid FROM {FTS_TABLE} WHERE rowid = %s'
+        pk = self.soup.pk
+        with connection.cursor() as cursor:
+            cursor.execute(query, [pk])
+            self.assertIsNotNone(cursor.fetchone())
+            with self.captureOnCommitCallbacks(execute=True):
+                self.soup.delete()
+            cursor.execute(query, [pk])
+            self.assertIsNone(cursor.fetchone())
+
+
+class RelationStatementsTest(APITestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def request(self, method, url, expected_status):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url)
+        self.assertEqual(response.status_code, expected_status)
+        return response, get_statements(queries.captured_queries)
+
+    def get_budget(self, postgresql, sqlite):
+        return postgresql if connection.vendor == 'postgresql' else sqlite
+
+    def get_counters(self):
+        self.recipe.refresh_from_db()
+        return self.recipe.favorites_count, self.recipe.cart_count
+
+    def test_favorite_and_cart(self):
+        for url, counters in (
+            (f'/api/recipes/{self.recipe.pk}/favorite/', (1, 0)),
+            (f'/api/recipes/{self.recipe.pk}/shopping_cart/', (1, 1)),
+        ):
+            with self.subTest(url=url):
+                response, statements = self.request('post', url, 201)
+                self.assertLessEqual(
+                    len(statements), self.get_budget(1, 3), statements
+                )
+                self.assertEqual(response.data['name'], self.recipe.name)
+                self.assertEqual(self.get_counters(), counters)
+        self.request(
+            'post', f'/api/recipes/{self.recipe.pk}/favorite/', 400
+        )
+        _, statements = self.request(
+            'delete', f'/api/recipes/{self.recipe.pk}/favorite/', 204
+        )
+        self.assertLessEqual(
+            len(statements), self.get_budget(1, 2), statements
+        )
+        self.assertEqual(self.get_counters(), (0, 1))
+        self.request(
+            'delete', f'/api/recipes/{self.recipe.pk}/favorite/', 400
+        )
+        self.assertEqual(self.get_counters(), (0, 1))
+
+    def test_subscribe(self):
+        url = f'/api/users/{self.author.pk}/subscribe/'
+        response, statements = self.request('post', url, 201)
+        self.assertLessEqual(
+            len(statements), self.get_budget(2, 4), statements
+        )
+        self.assertTrue(response.data['is_subscribed'])
+        self.assertEqual(response.data['recipes_count'], 1)
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['recipes']],
+            [self.recipe.pk],
+        )
+        self.assertQuerysetEqual(
+            TimelineEntry.objects.filter(user=self.user).values_list(
+                'recipe_id', flat=True
+            ),
+            [self.recipe.pk],
+        )
+        self.request('post', url, 400)
+        _, statements = self.request('delete', url, 204)
+        self.assertLessEqual(
+            len(statements), self.get_budget(1, 2), statements
+        )
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user))
+
+    def test_orm_changes_update_counters_once(self):
+        Favorites.objects.create(user=self.user, recipe=self.recipe)
+        Favorites.objects.create(user=self.author, recipe=self.recipe)
+        Shopping_cart.objects.create(user=self.user, recipe=self.recipe)
+        self.assertEqual(self.get_counters(), (2, 1))
+        Favorites.objects.filter(user=self.author).delete()
+        self.assertEqual(self.get_counters(), (1, 1))
+        self.user.delete()
+        self.assertEqual(self.get_counters(), (0, 0))
+
+    def test_orm_subscription_updates_timeline(self):
+        subscription = Subscriptions.objects.create(
+            user=self.user, author=self.author
+        )
+        self.assertTrue(TimelineEntry.objects.filter(user=self.user))
+        subscription.delete()
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user))
+
+
+class RecipeCountersTest(APITestBase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.soup = cls.create_recipe(cls.author, 'Суп', cls.ingredients[:2])
+        cls.salad = cls.create_recipe(
+            cls.author, 'Салат', cls.ingredients[2:]
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def get_counters(self):
+        return {
+            name: (favorites, cart)
+            for name, favorites, cart in Recipe.objects.values_list(
+                'name', 'favorites_count', 'cart_count'
+            )
+        }
+
+    def test_popular_ordering(self):
+        Favorites.objects.create(user=self.user, recipe=self.salad)
+        Favorites.objects.create(user=self.author, recipe=self.salad)
+        Favorites.objects.create(user=self.user, recipe=self.recipe)
+        response = self.client.get('/api/recipes/', {'ordering': 'popular'})
+        self.assertEqual(
+            [recipe['name'] for recipe in response.data['results']],
+            ['Салат', 'Каша', 'Суп'],
+        )
+
+    def test_bulk_operations(self):
+        ids = [self.recipe.pk, self.soup.pk, self.salad.pk]
+        for url in ('/api/recipes/favorite/', '/api/recipes/shopping_cart/'):
+            response = self.client.post(url, {'ids': ids}, format='json')
+            self.assertEqual(response.status_code, 200)
+        response = self.client.post(
+            '/api/recipes/favorite/', {'ids': [self.soup.pk, 0]},
+            format='json',
+        )
+        self.assertEqual(response.data['results'], [
+            {'id': self.soup.pk, 'status': 'exists'},
+            {'id': 0, 'status': 'not_found'},
+        ])
+        self.assertEqual(self.get_counters(), {
+            'Каша': (1, 1), 'Суп': (1, 1), 'Салат': (1, 1),
+        })
+        response = self.client.delete(
+            '/api/recipes/favorite/',
+            {'ids': [self.soup.pk, self.salad.pk, self.soup.pk]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.client.delete(
+            f'/api/recipes/{self.recipe.pk}/shopping_cart/'
+        )
+        self.assertEqual(self.get_counters(), {
+            'Каша': (1, 0), 'Суп': (0, 1), 'Салат': (0, 1),
+        })
+
+    def test_recount_fixes_drift(self):
+        Favorites.objects.create(user=self.user, recipe=self.soup)
+        Shopping_cart.objects.create(user=self.user, recipe=self.soup)
+        Recipe.objects.update(favorites_count=7, cart_count=0)
+        stdout = io.StringIO()
+        call_command('recount_recipes', stdout=stdout)
+        self.assertIn('3', stdout.getvalue())
+        self.assertEqual(self.get_counters(), {
+            'Каша': (0, 0), 'Суп': (1, 1), 'Салат': (0, 0),
+        })
+
+    def test_admin_ingredient_changes_reach_api(self):
+        version = get_version('recipes')
+        model_admin = RecipeIngredientAdmin(RecipeIngredient, admin.site)
+        with self.captureOnCommitCallbacks(execute=True):
+            model_admin.delete_queryset(None, RecipeIngredient.objects.filter(
+                recipe=self.soup, ingredient=self.ingredients[1]
+            ))
+        self.assertNotEqual(get_version('recipes'), version)
+        for query, found in (('ингредиент 0', True), ('ингредиент 1', False)):
+            response = self.client.get('/api/recipes/', {'search': query})
+            names = [recipe['name'] for recipe in response.data['results']]
+            self.assertEqual('Суп' in names, found, query)
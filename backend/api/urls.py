@@ -1,7 +1,7 @@
 from django.urls import include, path
 from rest_framework import routers
 
-from api import views
+from api import async_views, views
 
 app_name = 'api'
 
@@ -11,7 +11,20 @@ router.register('tags', views.TagViewsSet, basename='tags')
 router.register('recipes', views.RecipeViewSet, basename='recipes')
 router.register('ingredients', views.IngredientViewSet, basename='ingredients')
 
+async_urlpatterns = [
+    path('recipes/', async_views.recipe_list, name='recipes-list'),
+    path(
+        'recipes/<int:pk>/', async_views.recipe_detail, name='recipes-detail'
+    ),
+    path(
+        'ingredients/', async_views.ingredient_list, name='ingredients-list'
+    ),
+    path('tags/', async_views.tag_list, name='tags-list'),
+]
+
 urlpatterns = [
+    path('stats/', views.PerformanceStatsView.as_view(), name='stats'),
+    path('async/', include((async_urlpatterns, 'async'))),
     path('', include(router.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken'))]
@@ -1,31 +1,65 @@
-from django.db.models.query_utils import Q
-from django.shortcuts import HttpResponse, get_object_or_404
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from rest_framework import exceptions, status, viewsets
+from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.exceptions import ValidationError
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from recipes.models import (Favorites, Ingredient, Recipe, RecipeIngredient,
-                            Shopping_cart, Tag)
+from recipes.models import (Favorites, Ingredient, Recipe, Shopping_cart,
+                            SimilarRecipe, Tag)
 from users.models import Subscriptions, User
 
-from .filters import RecipesFilter
+from .authentication import token_cache
+from .cache import get_version
+from .exports import export_shopping_list
+from .filters import POPULAR_ORDERING, RecipesFilter
+from .middleware import endpoint_stats
+from .mixins import RelationMixin, VersionedCacheMixin
 from .pagination import CustomPaginator
+from .pantry import pantry_index
 from .permissions import CustomAuthorOrReadOnly
+from .renderers import CSVRenderer, PDFRenderer, TextRenderer
+from .search import ingredient_index
 from .serializer import (CustomUserSerializer, IngredientSerializer,
+                         PantryRecipeSerializer, PantrySerializer,
                          PasswordSetSerializer, RecipeCreateSerializer,
                          RecipeListSerializer, RecipeSerializer,
                          SubscriptionsSerializer, TagSerializer,
                          UserCreateSerializer)
+from .services import (FEED_ORDERING, apply_user_flags,
+                       get_missing_ingredients, get_recipes, get_recipes_limit,
+                       get_subscriptions, get_timeline, get_user_flags)
 
 
-class CustomUserViewSet(UserViewSet):
+class CustomUserViewSet(RelationMixin, UserViewSet):
     queryset = User.objects.all()
     permission_classes = (CustomAuthorOrReadOnly,)
     pagination_class = CustomPaginator
+    cursor_ordering = {'subscriptions': ('-date_subscriptions', '-id')}
+    relation_errors = {
+        Subscriptions: {
+            'not_found': (
+                status.HTTP_404_NOT_FOUND, 'Автор не найден.'
+            ),
+            'self': (
+                status.HTTP_400_BAD_REQUEST,
+                'Нельзя подписаться на самого себя!',
+            ),
+            'exists': (
+                status.HTTP_400_BAD_REQUEST,
+                'Вы уже подписаны на этого автора.',
+            ),
+            'missing': (
+                status.HTTP_400_BAD_REQUEST,
+                'Подписка не была оформлена, либо уже удалена.',
+            ),
+        },
+    }
 
     def get_serializer_class(self):
         if self.action in ('list', 'retrieve'):
@@ -74,42 +108,23 @@ class CustomUserViewSet(UserViewSet):
         serializer_class=SubscriptionsSerializer,
         pagination_class=None,
     )
+    @transaction.atomic
     def subscribe(self, request, id=None):
-        user = self.request.user
-        author = get_object_or_404(User, pk=id)
-
-        if self.request.method == 'POST':
-            if user == author:
-                raise exceptions.ValidationError(
-                    'Нельзя подписаться на самого себя!'
-                )
-            if Subscriptions.objects.filter(
-                user=user,
-                author=author
-            ).exists():
-                raise exceptions.ValidationError(
-                    'Вы уже подписаны на этого автора.'
-                )
-            Subscriptions.objects.create(user=user, author=author)
-            serializer = self.get_serializer(author)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-        if self.request.method == 'DELETE':
-            if not Subscriptions.objects.filter(
-                user=user,
-                author=author
-            ).exists():
-                raise exceptions.ValidationError(
-                    'Подписка не была оформлена, либо уже удалена.'
-                )
-            subscription = get_object_or_404(
-                Subscriptions,
-                user=user,
-                author=author
+        if request.method == 'POST':
+            return self.add_relation(
+                Subscriptions, id, SubscriptionsSerializer
             )
-            subscription.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+        return self.remove_relation(Subscriptions, id)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='subscribe',
+        permission_classes=(IsAuthenticated,),
+    )
+    @transaction.atomic
+    def subscribe_bulk(self, request):
+        return self.bulk_relations(Subscriptions)
 
     @action(
         detail=False,
@@ -118,58 +133,126 @@ class CustomUserViewSet(UserViewSet):
         pagination_class=CustomPaginator,
     )
     def subscriptions(self, request):
-        queryset = User.objects.filter(subscribing__user=request.user)
+        queryset = get_subscriptions(
+            request.user, get_recipes_limit(request)
+        )
         page = self.paginate_queryset(queryset)
         serializer = SubscriptionsSerializer(
             page, many=True, context={'request': request}
         )
         return self.get_paginated_response(serializer.data)
 
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=(IsAuthenticated,),
+    )
+    def timeline(self, request):
+        recipes = self.paginator.paginate_by_key(
+            request,
+            lambda cursor, page_size: get_timeline(
+                request.user, cursor, page_size
+            ),
+            FEED_ORDERING,
+            key=lambda recipe: [recipe.pub_date, recipe.pk],
+        )
+        request._subscribed_ids = get_user_flags(request.user)[
+            'subscriptions'
+        ]
+        serializer = RecipeSerializer(
+            recipes, many=True, context={'request': request}
+        )
+        return self.get_paginated_response(serializer.data)
+
 
-class TagViewsSet(viewsets.ReadOnlyModelViewSet):
+class TagViewsSet(VersionedCacheMixin, viewsets.ReadOnlyModelViewSet):
+    cache_version_name = 'tags'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
     permission_classes = (AllowAny,)
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(VersionedCacheMixin, viewsets.ReadOnlyModelViewSet):
+    cache_version_name = 'ingredients'
     serializer_class = IngredientSerializer
     pagination_class = None
     queryset = Ingredient.objects.all()
 
-    def get_queryset(self):
-        queryset = Ingredient.objects.all()
-        name = self.request.query_params.get('name')
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
         if name is not None:
-            filter_one_input = queryset.filter(name__istartswith=name)
-            filter_center_input = queryset.filter(
-                ~Q(name__istartswith=name) & Q(name__icontains=name)
-            )
-            queryset = list(filter_one_input) + list(filter_center_input)
-        return queryset
+            return Response(ingredient_index.search(
+                name, settings.INGREDIENTS_SEARCH_LIMIT
+            ))
+        return super().list(request, *args, **kwargs)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(RelationMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     permission_classes = (CustomAuthorOrReadOnly,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipesFilter
     pagination_class = CustomPaginator
+    relation_errors = {
+        Favorites: {
+            'not_found': (status.HTTP_400_BAD_REQUEST, 'Рецепт не найден.'),
+            'exists': (
+                status.HTTP_400_BAD_REQUEST, 'Рецепт уже в избранном.'
+            ),
+            'missing': (
+                status.HTTP_400_BAD_REQUEST, 'Рецепта нет в избранном.'
+            ),
+        },
+        Shopping_cart: {
+            'not_found': (status.HTTP_400_BAD_REQUEST, 'Рецепт не найден.'),
+            'exists': (
+                status.HTTP_400_BAD_REQUEST, 'Рецепт уже в списке покупок.'
+            ),
+            'missing': (
+                status.HTTP_404_NOT_FOUND, 'Рецепта нет в списке покупок.'
+            ),
+        },
+    }
+
+    @property
+    def cursor_ordering(self):
+        if self.request.query_params.get('search'):
+            return {}
+        if self.request.query_params.get('ordering') == 'popular':
+            return {'list': POPULAR_ORDERING}
+        return {'list': ('-pub_date', '-id')}
 
     def get_serializer_class(self):
-        if self.action in ('list', 'retrive'):
+        if self.action in ('list', 'retrieve'):
             return RecipeSerializer
         return RecipeCreateSerializer
 
     def get_queryset(self):
-        recipes = Recipe.objects.prefetch_related(
-            'recipe_ingredients__ingredient',
-            'tags',
-            'favorite_recipe',
-            'shopping_recipe',
-        ).all()
-        return recipes
+        return get_recipes(self.request.user)
+
+    def update(self, request, *args, **kwargs):
+        serializer = self.get_serializer(
+            self.get_object(),
+            data=request.data,
+            partial=kwargs.pop('partial', False),
+        )
+        serializer.is_valid(raise_exception=True)
+        self.perform_update(serializer)
+        return Response(serializer.data)
+
+    def list(self, request, *args, **kwargs):
+        if {'is_favorited', 'is_in_shopping_cart'} & set(request.query_params):
+            return super().list(request, *args, **kwargs)
+        key = 'recipes:{}:{}'.format(
+            get_version('recipes'), request.build_absolute_uri()
+        )
+        data = cache.get(key)
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            cache.set(key, data, settings.RECIPES_CACHE_TIMEOUT)
+        apply_user_flags(data['results'], request.user)
+        return Response(data)
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
@@ -179,35 +262,21 @@ class RecipeViewSet(viewsets.ModelViewSet):
         detail=True,
         url_path='favorite',
     )
+    @transaction.atomic
     def favorite(self, request, pk):
-        try:
-            if request.method == 'POST':
-                if Recipe.objects.filter(pk=pk).exists():
-                    if not Favorites.objects.filter(
-                        user=request.user,
-                            recipe=get_object_or_404(Recipe, pk=pk)).exists():
-                        Favorites.objects.create(
-                            user=request.user,
-                            recipe=get_object_or_404(Recipe, pk=pk))
-                        recipe = Recipe.objects.get(id=pk)
-                        serializer = RecipeListSerializer(recipe)
-                        return Response(serializer.data,
-                                        status=status.HTTP_201_CREATED)
-                    return Response(status=status.HTTP_400_BAD_REQUEST)
-                return Response(status=status.HTTP_400_BAD_REQUEST)
-
-            elif request.method == 'DELETE':
-                if Favorites.objects.filter(
-                        user=request.user,
-                        recipe=get_object_or_404(Recipe, pk=pk)).exists():
-                    Favorites.objects.filter(
-                        user=request.user,
-                        recipe=get_object_or_404(Recipe, pk=pk)).delete()
-                    return Response(status=status.HTTP_204_NO_CONTENT)
-                else:
-                    return Response(status=status.HTTP_400_BAD_REQUEST)
-        except ValueError:
-            raise ValidationError("ID не должно быть строкой")
+        if request.method == 'POST':
+            return self.add_relation(Favorites, pk, RecipeListSerializer)
+        return self.remove_relation(Favorites, pk)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='favorite',
+        permission_classes=(IsAuthenticated,),
+    )
+    @transaction.atomic
+    def favorite_bulk(self, request):
+        return self.bulk_relations(Favorites)
 
     @action(
         detail=True,
@@ -215,66 +284,81 @@ class RecipeViewSet(viewsets.ModelViewSet):
         permission_classes=(IsAuthenticated,),
         pagination_class=None,
     )
-    def shopping_cart(self, request, **kwargs):
-        try:
-            if Recipe.objects.filter(id=kwargs.get('pk')).exists():
-                recipe = Recipe.objects.get(id=kwargs.get('pk'))
-            else:
-                return Response(status=status.HTTP_400_BAD_REQUEST)
-
-            if request.method == 'POST':
-                serializer = RecipeListSerializer(recipe, data=request.data,
-                                                  context={"request": request})
-                serializer.is_valid(raise_exception=True)
-                if not Shopping_cart.objects.filter(user=request.user,
-                                                    recipe=recipe).exists():
-                    Shopping_cart.objects.create(user=request.user,
-                                                 recipe=recipe)
-                    return Response(serializer.data,
-                                    status=status.HTTP_201_CREATED)
-                return Response({'errors': 'Рецепт уже в списке покупок.'},
-                                status=status.HTTP_400_BAD_REQUEST)
-
-            if request.method == 'DELETE':
-                get_object_or_404(Shopping_cart, user=request.user,
-                                  recipe=recipe).delete()
-                return Response(
-                    {'detail': 'Рецепт удален из списка покупок.'},
-                    status=status.HTTP_204_NO_CONTENT
-                )
-        except ValueError:
-            raise ValidationError("ID не должно быть строкой")
+    @transaction.atomic
+    def shopping_cart(self, request, pk):
+        if request.method == 'POST':
+            return self.add_relation(Shopping_cart, pk, RecipeListSerializer)
+        return self.remove_relation(Shopping_cart, pk)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='shopping_cart',
+        permission_classes=(IsAuthenticated,),
+    )
+    @transaction.atomic
+    def shopping_cart_bulk(self, request):
+        return self.bulk_relations(Shopping_cart)
 
     @action(
         detail=False,
         methods=['get'],
         permission_classes=[IsAuthenticated],
+        renderer_classes=(TextRenderer, CSVRenderer, PDFRenderer),
     )
     def download_shopping_cart(self, request):
-        user = request.user
-        shopping = user.shopping_user.all()
-        shopping_list = {}
-        for shop in shopping:
-            recipe = shop.recipe
-            ingredients = RecipeIngredient.objects.filter(recipe=recipe)
-            for ingredient in ingredients:
-                name = ingredient.ingredient.name
-                amount = ingredient.amount
-                measurement_unit = ingredient.ingredient.measurement_unit
-                if name not in shopping_list:
-                    shopping_list[name] = {
-                        'measurement_unit': measurement_unit,
-                        'amount': amount,
-                    }
-                else:
-                    shopping_list[name]['amount'] += amount
-        shop_list = [
-            f"{name} - {data['amount']}{data['measurement_unit']}"
-            for name, data in shopping_list.items()
-        ]
-        responce = HttpResponse(
-            'Cписок покупок:\n' + '\n'.join(shop_list),
-            content_type='text/plain',
+        return export_shopping_list(
+            request.user, request.accepted_renderer.format
+        )
+
+    @action(detail=False, methods=['get'])
+    def pantry(self, request):
+        serializer = PantrySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        ingredients = serializer.validated_data['ingredients']
+        matches = self.paginate_queryset(pantry_index.match(
+            ingredients, serializer.validated_data['max_missing']
+        ))
+        ids = [recipe_id for recipe_id, _ in matches]
+        recipes = Recipe.objects.in_bulk(ids)
+        serializer = PantryRecipeSerializer(
+            [recipes[pk] for pk in ids if pk in recipes],
+            many=True,
+            context={
+                **self.get_serializer_context(),
+                'missing': get_missing_ingredients(ids, ingredients),
+            },
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'], pagination_class=None)
+    def similar(self, request, pk):
+        pk = self.get_relation_id(pk)
+        rows = list(
+            SimilarRecipe.objects.filter(recipe_id=pk)
+            .select_related('similar')
+            .order_by('-score')[:settings.SIMILAR_RECIPES_LIMIT]
+        )
+        if not rows and not Recipe.objects.filter(pk=pk).exists():
+            raise NotFound('Рецепт не найден.')
+        serializer = RecipeListSerializer(
+            [row.similar for row in rows],
+            many=True,
+            context=self.get_serializer_context(),
         )
-        responce['Content-Disposition'] = 'attachment; filename=shop_list.txt'
-        return responce
+        return Response(serializer.data)
+
+
+class PerformanceStatsView(APIView):
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response({
+            **endpoint_stats.snapshot(),
+            'token_cache': token_cache.snapshot(),
+        })
+
+    def delete(self, request):
+        endpoint_stats.reset()
+        token_cache.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -37,6 +37,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.QueryBudgetMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -80,10 +81,30 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', 'foodgram_user'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', ''),
-        'PORT': os.getenv('DB_PORT', '5432')
+        'PORT': os.getenv('DB_PORT', '5432'),
+        'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', 60)),
     }
 }
 
+# Версии кэша, токены и флаги пользователей должны быть общими для всех
+# воркеров gunicorn. LocMemCache живёт внутри одного процесса и годится
+# только для разработки и тестов.
+REDIS_URL = os.getenv('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -133,7 +154,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticatedOrReadOnly'
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication'
+        'api.authentication.CachedTokenAuthentication'
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 6,
@@ -158,3 +179,76 @@ DJOSER = {
 
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_URLS_REGEX = r'^/api/.*$'
+
+INGREDIENTS_SEARCH_LIMIT = int(os.getenv('INGREDIENTS_SEARCH_LIMIT', 100))
+INGREDIENTS_INDEX_TTL = int(os.getenv('INGREDIENTS_INDEX_TTL', 300))
+REFERENCE_CACHE_TIMEOUT = int(os.getenv('REFERENCE_CACHE_TIMEOUT', 3600))
+REFERENCE_CACHE_MAX_AGE = int(os.getenv('REFERENCE_CACHE_MAX_AGE', 60))
+RECIPES_CACHE_TIMEOUT = int(os.getenv('RECIPES_CACHE_TIMEOUT', 300))
+
+QUERY_BUDGET_STRICT = os.getenv('QUERY_BUDGET_STRICT', 'False') == 'True'
+QUERY_BUDGETS = {
+    'RecipeViewSet.list': 10,
+    'RecipeViewSet.retrieve': 7,
+    'RecipeViewSet.download_shopping_cart': 3,
+    'RecipeViewSet.pantry': 4,
+    'RecipeViewSet.similar': 3,
+    'CustomUserViewSet.list': 5,
+    'CustomUserViewSet.subscriptions': 6,
+    'CustomUserViewSet.timeline': 10,
+    'TagViewsSet.list': 2,
+    'IngredientViewSet.list': 2,
+    'async.recipe_list': 10,
+    'async.recipe_detail': 7,
+    'async.tag_list': 2,
+    'async.ingredient_list': 2,
+}
+
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+IMAGE_WEBP_QUALITY = int(os.getenv('IMAGE_WEBP_QUALITY', 80))
+RECIPE_IMAGE_VARIANTS = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'detail': (1200, 1200),
+}
+
+BULK_MAX_ITEMS = int(os.getenv('BULK_MAX_ITEMS', 100))
+
+SHOPPING_LIST_FONT = os.getenv(
+    'SHOPPING_LIST_FONT', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+SHOPPING_LIST_CACHE_TIMEOUT = int(
+    os.getenv('SHOPPING_LIST_CACHE_TIMEOUT', 3600)
+)
+SHOPPING_LIST_CACHE_MAX_SIZE = int(
+    os.getenv('SHOPPING_LIST_CACHE_MAX_SIZE', 2 * 1024 * 1024)
+)
+
+ASYNC_DB_WORKERS = int(os.getenv('ASYNC_DB_WORKERS', 8))
+ASYNC_DB_PING_INTERVAL = int(os.getenv('ASYNC_DB_PING_INTERVAL', 30))
+
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', 'russian')
+
+PANTRY_INDEX_TTL = int(os.getenv('PANTRY_INDEX_TTL', 600))
+PANTRY_INDEX_MAX_OVERLAY = int(os.getenv('PANTRY_INDEX_MAX_OVERLAY', 5000))
+PANTRY_MAX_INGREDIENTS = int(os.getenv('PANTRY_MAX_INGREDIENTS', 200))
+PANTRY_MAX_MISSING = int(os.getenv('PANTRY_MAX_MISSING', 5))
+
+SIMILAR_RECIPES_LIMIT = int(os.getenv('SIMILAR_RECIPES_LIMIT', 10))
+SIMILAR_RECIPES_MAX_POSTING = int(
+    os.getenv('SIMILAR_RECIPES_MAX_POSTING', 500)
+)
+SIMILAR_RECIPES_WEIGHTS = {
+    'favorites': 0.6,
+    'ingredients': 0.3,
+    'tags': 0.1,
+}
+
+TIMELINE_FANOUT_LIMIT = int(os.getenv('TIMELINE_FANOUT_LIMIT', 5000))
+TIMELINE_BACKFILL_LIMIT = int(os.getenv('TIMELINE_BACKFILL_LIMIT', 100))
+
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv('AUTH_TOKEN_CACHE_TIMEOUT', 300))
+AUTH_TOKEN_LOCAL_TTL = int(os.getenv('AUTH_TOKEN_LOCAL_TTL', 10))
+AUTH_TOKEN_LOCAL_CACHE_SIZE = int(
+    os.getenv('AUTH_TOKEN_LOCAL_CACHE_SIZE', 10000)
+)
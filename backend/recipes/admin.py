@@ -1,6 +1,7 @@
 from django.contrib import admin
 
 from recipes import models
+from recipes.signals import ingredients_changed
 
 
 class RecipesIngredientInline(admin.TabularInline):
@@ -25,16 +26,30 @@ class TagAdmin(admin.ModelAdmin):
 
 @admin.register(models.Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('pk', 'name', 'author', 'in_favorites')
+    list_display = ('pk', 'name', 'author', 'in_favorites', 'cart_count')
     list_editable = ('name', 'author')
-    readonly_fields = ('in_favorites',)
+    readonly_fields = ('in_favorites', 'cart_count')
     list_filter = ('name', 'author', 'tags')
     empty_value_display = '-пусто-'
     inlines = (RecipesIngredientInline,)
 
     @admin.display(description='В избранном')
     def in_favorites(self, obj):
-        return obj.favorite_recipe.count()
+        return obj.favorites_count
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            return super().save_model(request, obj, form, change)
+        fields = {field.name for field in obj._meta.concrete_fields}
+        changed = [name for name in form.changed_data if name in fields]
+        if changed:
+            obj.save(update_fields=changed)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        ingredients_changed.send(
+            sender=models.Recipe, recipe_ids=[form.instance.pk]
+        )
 
 
 @admin.register(models.RecipeIngredient)
@@ -42,6 +57,19 @@ class RecipeIngredientAdmin(admin.ModelAdmin):
     list_display = ('pk', 'recipe', 'ingredient', 'amount')
     list_editable = ('recipe', 'ingredient', 'amount')
 
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        ingredients_changed.send(
+            sender=models.Recipe, recipe_ids=[obj.recipe_id]
+        )
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = set(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        ingredients_changed.send(
+            sender=models.Recipe, recipe_ids=recipe_ids
+        )
+
 
 @admin.register(models.Favorites)
 class FavoritesAdmin(admin.ModelAdmin):
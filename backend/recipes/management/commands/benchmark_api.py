@@ -0,0 +1,316 @@
+import asyncio
+import json
+import math
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+
+ASYNC_PREFIX = '/api/async/'
+ASYNC_ENDPOINTS = ('recipes', 'recipes_by_tag', 'recipe', 'ingredients')
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+PERCENTILES = (50, 95, 99)
+MIX = {
+    'recipes': 4,
+    'recipes_by_tag': 3,
+    'recipe': 2,
+    'ingredients': 4,
+    'subscriptions': 1,
+    'download_shopping_cart': 1,
+}
+
+
+def percentile(values, rank):
+    values = sorted(values)
+    return values[max(math.ceil(rank / 100 * len(values)) - 1, 0)]
+
+
+def get_sample(name, response, elapsed):
+    queries = SERVER_TIMING_QUERIES.search(response.get('Server-Timing', ''))
+    return {
+        'name': name,
+        'status': response.status_code,
+        'time': elapsed * 1000,
+        'queries': int(queries.group(1)) if queries else 0,
+    }
+
+
+def summarize(samples, duration=None):
+    timings = [sample['time'] for sample in samples]
+    summary = {
+        'requests': len(samples),
+        'errors': sum(sample['status'] >= 400 for sample in samples),
+        'mean_ms': round(sum(timings) / len(timings), 2),
+        **{
+            f'p{rank}_ms': round(percentile(timings, rank), 2)
+            for rank in PERCENTILES
+        },
+        'queries_avg': round(
+            sum(sample['queries'] for sample in samples) / len(samples), 2
+        ),
+        'queries_max': max(sample['queries'] for sample in samples),
+    }
+    if duration:
+        summary['throughput_rps'] = round(len(samples) / duration, 1)
+    return summary
+
+
+class Workload:
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.slugs = list(Tag.objects.values_list('slug', flat=True))
+        self.ids = list(
+            Recipe.objects.order_by('-pub_date', '-id')
+            .values_list('pk', flat=True)[:1000]
+        )
+        self.names = list(
+            Ingredient.objects.order_by('?')
+            .values_list('name', flat=True)[:500]
+        )
+        user = (
+            User.objects.filter(
+                subscriber__isnull=False, shopping_user__isnull=False
+            ).first()
+            or User.objects.first()
+        )
+        if not (self.slugs and self.ids and self.names and user):
+            raise CommandError(
+                'База пуста: сначала выполните import и generate_data.'
+            )
+        self.token = Token.objects.get_or_create(user=user)[0].key
+
+    def recipes(self):
+        page = self.rng.randint(1, 5)
+        return f'/api/recipes/?limit=6&page={page}', False
+
+    def recipes_by_tag(self):
+        tags = self.rng.sample(
+            self.slugs, self.rng.randint(1, len(self.slugs))
+        )
+        query = '&'.join(f'tags={tag}' for tag in tags)
+        return f'/api/recipes/?limit=6&{query}', False
+
+    def recipe(self):
+        return f'/api/recipes/{self.rng.choice(self.ids)}/', False
+
+    def ingredients(self):
+        name = self.rng.choice(self.names)[:self.rng.randint(1, 3)]
+        return f'/api/ingredients/?name={name}', False
+
+    def subscriptions(self):
+        return '/api/users/subscriptions/?recipes_limit=3', True
+
+    def download_shopping_cart(self):
+        return '/api/recipes/download_shopping_cart/', True
+
+    def plan(self, count, mix):
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        return [
+            (name, *getattr(self, name)())
+            for name in self.rng.choices(names, weights, k=count)
+        ]
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогоняет смесь запросов к API через тестовый клиент Django и '
+        'сохраняет p50/p95/p99, число SQL-запросов и пропускную способность.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--warmup', type=int, default=50)
+        parser.add_argument('--concurrency', type=int, default=1)
+        parser.add_argument(
+            '--mode',
+            choices=('sync', 'async'),
+            default='sync',
+            help=(
+                'sync — WSGI-обработчик, потоки; async — ASGI-обработчик и '
+                f'эндпоинты {ASYNC_PREFIX}, конкурентные задачи asyncio.'
+            ),
+        )
+        parser.add_argument(
+            '--endpoints',
+            nargs='+',
+            choices=list(MIX),
+            default=list(MIX),
+        )
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument(
+            '--clear-cache',
+            action='store_true',
+            help='Очистить кэш перед прогоном.',
+        )
+        parser.add_argument('--output', help='Файл для JSON-результатов.')
+        parser.add_argument(
+            '--compare', help='JSON-результаты прошлого прогона.'
+        )
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError(
+                'Число запросов и потоков должно быть больше 0.'
+            )
+        mode = options['mode']
+        endpoints = options['endpoints']
+        if mode == 'async':
+            endpoints = [name for name in endpoints if name in ASYNC_ENDPOINTS]
+            if not endpoints:
+                raise CommandError(
+                    'В async-режиме доступны только: '
+                    f'{", ".join(ASYNC_ENDPOINTS)}.'
+                )
+        workload = Workload(options['seed'])
+        mix = {name: MIX[name] for name in endpoints}
+        if options['clear_cache']:
+            cache.clear()
+        with override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']
+        ):
+            self.run(
+                workload.plan(options['warmup'], mix), workload.token, 1, mode
+            )
+            plan = workload.plan(options['requests'], mix)
+            started = time.perf_counter()
+            samples = self.run(
+                plan, workload.token, options['concurrency'], mode
+            )
+            duration = time.perf_counter() - started
+        results = {
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'options': {
+                name: options[name]
+                for name in (
+                    'mode', 'requests', 'warmup', 'concurrency', 'seed',
+                    'clear_cache',
+                )
+            },
+            'mix': mix,
+            'total': summarize(samples, duration),
+            'endpoints': {
+                name: summarize(
+                    [sample for sample in samples if sample['name'] == name]
+                )
+                for name in mix
+                if any(sample['name'] == name for sample in samples)
+            },
+        }
+        self.print_results(results)
+        if options['compare']:
+            self.compare(results, options['compare'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+            self.stdout.write(
+                f'Результаты сохранены в {options["output"]}.'
+            )
+
+    def run(self, plan, token, concurrency, mode):
+        if mode == 'async':
+            return asyncio.run(
+                self.request_all_async(plan, token, concurrency)
+            )
+        if concurrency == 1:
+            return self.request_all(plan, token)
+        chunks = [plan[index::concurrency] for index in range(concurrency)]
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return [
+                sample
+                for samples in executor.map(
+                    self.request_all, chunks, [token] * concurrency
+                )
+                for sample in samples
+            ]
+
+    def request_all(self, plan, token):
+        client = Client(raise_request_exception=False)
+        samples = []
+        try:
+            for name, url, authenticated in plan:
+                headers = {}
+                if authenticated:
+                    headers['HTTP_AUTHORIZATION'] = f'Token {token}'
+                started = time.perf_counter()
+                response = client.get(url, **headers)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                samples.append(
+                    get_sample(name, response, time.perf_counter() - started)
+                )
+        finally:
+            connection.close()
+        return samples
+
+    async def request_all_async(self, plan, token, concurrency):
+        async def worker(chunk):
+            client = AsyncClient(raise_request_exception=False)
+            samples = []
+            for name, url, authenticated in chunk:
+                headers = {}
+                if authenticated:
+                    headers['authorization'] = f'Token {token}'
+                started = time.perf_counter()
+                response = await client.get(
+                    url.replace('/api/', ASYNC_PREFIX, 1), **headers
+                )
+                samples.append(
+                    get_sample(name, response, time.perf_counter() - started)
+                )
+            return samples
+
+        results = await asyncio.gather(*(
+            worker(plan[index::concurrency]) for index in range(concurrency)
+        ))
+        return [sample for samples in results for sample in samples]
+
+    def print_results(self, results):
+        columns = ('requests', 'errors', 'p50_ms', 'p95_ms', 'p99_ms',
+                   'queries_avg')
+        self.stdout.write(
+            f'{"endpoint":<24}'
+            + ''.join(f'{column:>13}' for column in columns)
+        )
+        rows = {**results['endpoints'], 'total': results['total']}
+        for name, summary in rows.items():
+            self.stdout.write(
+                f'{name:<24}'
+                + ''.join(f'{summary[column]:>13}' for column in columns)
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Пропускная способность: {results["total"]["throughput_rps"]} '
+            f'запросов/с.'
+        ))
+
+    def compare(self, results, path):
+        try:
+            with open(path, encoding='utf-8') as file:
+                baseline = json.load(file)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
+        rows = {**results['endpoints'], 'total': results['total']}
+        baseline_rows = {**baseline['endpoints'], 'total': baseline['total']}
+        for name, summary in rows.items():
+            previous = baseline_rows.get(name)
+            if previous is None:
+                continue
+            changes = ', '.join(
+                f'{column} {previous[column]} → {summary[column]}'
+                for column in ('p50_ms', 'p95_ms', 'queries_avg')
+            )
+            self.stdout.write(f'{name}: {changes}')
@@ -0,0 +1,161 @@
+import base64
+import math
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+
+from api.fields import StreamingBase64ImageField
+from api.images import save_variants
+
+PERCENTILES = (50, 95)
+FIELDS = {
+    'before': Base64ImageField,
+    'after': StreamingBase64ImageField,
+}
+
+
+def percentile(values, rank):
+    values = sorted(values)
+    return values[max(math.ceil(rank / 100 * len(values)) - 1, 0)]
+
+
+def make_payload(width, height, rng):
+    size = width * height * 3
+    image = Image.frombytes(
+        'RGB', (width, height), rng.getrandbits(size * 8).to_bytes(size, 'big')
+    )
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=90)
+    return (
+        'data:image/jpeg;base64,'
+        + base64.b64encode(buffer.getvalue()).decode()
+    )
+
+
+def measure_memory(field, payload):
+    tracemalloc.start()
+    try:
+        current, _ = tracemalloc.get_traced_memory()
+        file = field.to_internal_value(payload)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    file.close()
+    return peak - current
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет пиковую память на одну загрузку картинки рецепта и '
+        'занятость воркеров: before — декодирование целиком в памяти и '
+        'превью в запросе, after — потоковое декодирование и превью в '
+        'фоновом пуле.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--uploads', type=int, default=20)
+        parser.add_argument(
+            '--size',
+            type=int,
+            nargs=2,
+            default=(1600, 1200),
+            metavar=('WIDTH', 'HEIGHT'),
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=0,
+            help='Пауза между загрузками, мс.',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=settings.IMAGE_WORKERS
+        )
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        width, height = options['size']
+        if min(width, height, options['uploads'], options['workers']) < 1:
+            raise CommandError(
+                'Неверный размер картинки, число загрузок или воркеров.'
+            )
+        payload = make_payload(width, height, random.Random(options['seed']))
+        self.stdout.write(
+            f'Картинка {width}x{height}: '
+            f'{len(payload) / 2 ** 20:.1f} МБ в base64.'
+        )
+        media_root = tempfile.mkdtemp()
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                for mode, field in FIELDS.items():
+                    self.benchmark(mode, field(), payload, options)
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+    def benchmark(self, mode, field, payload, options):
+        memory = measure_memory(field, payload)
+        executor = (
+            ThreadPoolExecutor(max_workers=options['workers'])
+            if mode == 'after' else None
+        )
+        requests = []
+        jobs = []
+
+        def run_job(name, submitted):
+            started = time.perf_counter()
+            save_variants(name)
+            jobs.append((submitted, started, time.perf_counter()))
+
+        first = time.perf_counter()
+        for _ in range(options['uploads']):
+            started = time.perf_counter()
+            file = field.to_internal_value(payload)
+            name = default_storage.save(f'recipes/images/{file.name}', file)
+            file.close()
+            if executor is None:
+                save_variants(name)
+            else:
+                executor.submit(run_job, name, time.perf_counter())
+            requests.append((time.perf_counter() - started) * 1000)
+            time.sleep(options['interval'] / 1000)
+        if executor is not None:
+            executor.shutdown(wait=True)
+        elapsed = time.perf_counter() - first
+        self.report(mode, memory, requests, jobs, elapsed, options)
+
+    def report(self, mode, memory, requests, jobs, elapsed, options):
+        timings = ', '.join(
+            f'p{rank} {percentile(requests, rank):.0f} мс'
+            for rank in PERCENTILES
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'{mode}: память на загрузку {memory / 2 ** 20:.2f} МБ, '
+            f'запрос держит воркер gunicorn {timings}, '
+            f'всё готово за {elapsed:.1f} с.'
+        ))
+        if not jobs:
+            return
+        busy = sum(finished - started for _, started, finished in jobs)
+        waits = [
+            (started - submitted) * 1000 for submitted, started, _ in jobs
+        ]
+        self.stdout.write(self.style.SUCCESS(
+            f'{mode}: пул превью занят на '
+            f'{busy / (options["workers"] * elapsed):.0%} '
+            f'(воркеров: {options["workers"]}), ожидание в очереди '
+            + ', '.join(
+                f'p{rank} {percentile(waits, rank):.0f} мс'
+                for rank in PERCENTILES
+            )
+            + '.'
+        ))
@@ -0,0 +1,139 @@
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.pantry import (build_index, match_in_database, pantry_index,
+                        rank_matches)
+from recipes.models import Ingredient
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values, rank):
+    values = sorted(values)
+    return values[max(math.ceil(rank / 100 * len(values)) - 1, 0)]
+
+
+def index_size(postings, totals):
+    return sum(
+        len(posting) * posting.itemsize for posting in postings.values()
+    ) + len(totals) * totals.itemsize
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет построение инвертированного индекса ингредиентов и '
+        'подбор рецептов «из того, что есть дома».'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            choices=('synthetic', 'database'),
+            default='synthetic',
+            help=(
+                'synthetic — индекс из сгенерированных в памяти данных; '
+                'database — индекс из базы и сравнение с запросом через ORM.'
+            ),
+        )
+        parser.add_argument('--recipes', type=int, default=1000000)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument(
+            '--ingredients-per-recipe',
+            type=int,
+            nargs=2,
+            default=(3, 12),
+            metavar=('MIN', 'MAX'),
+        )
+        parser.add_argument(
+            '--pantry-size',
+            type=int,
+            nargs=2,
+            default=(5, 30),
+            metavar=('MIN', 'MAX'),
+        )
+        parser.add_argument('--max-missing', type=int, default=3)
+        parser.add_argument('--queries', type=int, default=100)
+        parser.add_argument('--skew', type=float, default=2.0)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        low, high = options['pantry_size']
+        if not 0 < low <= high or options['queries'] < 1:
+            raise CommandError('Неверный размер запроса или число запросов.')
+        started = time.perf_counter()
+        if options['source'] == 'synthetic':
+            ingredients = list(range(1, options['ingredients'] + 1))
+            postings, totals = self.build_synthetic(ingredients, options)
+            overlay = {}
+        else:
+            ingredients = list(Ingredient.objects.values_list('pk', flat=True))
+            postings, totals, overlay = pantry_index.build()
+        if not ingredients:
+            raise CommandError('Нет ингредиентов для подбора.')
+        self.stdout.write(
+            f'Индекс: {len(postings)} ингредиентов, '
+            f'{sum(map(len, postings.values()))} связей, '
+            f'{index_size(postings, totals) / 2 ** 20:.1f} МБ, '
+            f'построен за {time.perf_counter() - started:.1f} с.'
+        )
+        pantries = [
+            self.pick(ingredients, self.rng.randint(low, high), options)
+            for _ in range(options['queries'])
+        ]
+        timings = []
+        found = []
+        for pantry in pantries:
+            started = time.perf_counter()
+            matches = rank_matches(
+                postings, totals, overlay, pantry, options['max_missing']
+            )
+            timings.append((time.perf_counter() - started) * 1000)
+            found.append(len(matches))
+        self.report('Индекс', timings, found)
+        if options['source'] == 'database':
+            self.benchmark_orm(pantries, options['max_missing'])
+
+    def pick(self, ingredients, count, options):
+        count = min(count, len(ingredients))
+        pantry = set()
+        while len(pantry) < count:
+            pantry.add(ingredients[
+                int(len(ingredients) * self.rng.random() ** options['skew'])
+            ])
+        return pantry
+
+    def build_synthetic(self, ingredients, options):
+        low, high = options['ingredients_per_recipe']
+        if not 0 < low <= high <= len(ingredients):
+            raise CommandError('Неверный диапазон числа ингредиентов.')
+        rows = (
+            (recipe_id, ingredient_id)
+            for recipe_id in range(1, options['recipes'] + 1)
+            for ingredient_id in self.pick(
+                ingredients, self.rng.randint(low, high), options
+            )
+        )
+        return build_index(rows, options['recipes'])
+
+    def benchmark_orm(self, pantries, max_missing):
+        timings = []
+        found = []
+        for pantry in pantries:
+            started = time.perf_counter()
+            found.append(len(match_in_database(pantry, max_missing)))
+            timings.append((time.perf_counter() - started) * 1000)
+        self.report('ORM', timings, found)
+
+    def report(self, title, timings, found):
+        values = ', '.join(
+            f'p{rank} {percentile(timings, rank):.1f} мс'
+            for rank in PERCENTILES
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'{title}: {values}, в среднем найдено '
+            f'{sum(found) / len(found):.0f} рецептов.'
+        ))
@@ -0,0 +1,47 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.similar import build_similar_recipes
+from recipes.models import Recipe
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает похожие рецепты по совместным добавлениям в '
+        'избранное и списки покупок, общим ингредиентам и тегам.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Пересчитать все рецепты, а не только изменившиеся.',
+        )
+        parser.add_argument(
+            '--limit', type=int, default=settings.SIMILAR_RECIPES_LIMIT
+        )
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['limit'] < 1 or options['batch_size'] < 1:
+            raise CommandError(
+                'Число похожих рецептов и размер пакета должны быть больше 0.'
+            )
+        recipes = Recipe.objects.all()
+        if not options['full']:
+            recipes = recipes.filter(similar_stale=True)
+        started = time.perf_counter()
+        done = 0
+        for count in build_similar_recipes(
+            recipes, options['limit'], options['batch_size']
+        ):
+            done += count
+            self.stdout.write(f'Обработано рецептов: {done}.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Похожие рецепты пересчитаны для {done} рецептов за '
+            f'{time.perf_counter() - started:.1f} с.'
+        ))
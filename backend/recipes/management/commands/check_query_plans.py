@@ -0,0 +1,155 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.filters import POPULAR_ORDERING
+from api.services import get_shopping_list, get_subscriptions
+from recipes.models import Favorites, Recipe, Shopping_cart, SimilarRecipe, Tag
+from users.models import Subscriptions, User
+
+FEED_ORDERING = ('-pub_date', '-id')
+PAGE_SIZE = 6
+
+SCAN_PATTERNS = {
+    'postgresql': re.compile(r'Seq Scan on "?(\w+)"?'),
+    'sqlite': re.compile(r'\bSCAN (?:TABLE )?"?(\w+)"?(?! USING)'),
+}
+SORT_PATTERNS = {
+    'postgresql': re.compile(r'\bSort\b'),
+    'sqlite': re.compile(r'USE TEMP B-TREE FOR ORDER BY'),
+}
+
+
+def get_checks(user, author, tags):
+    recipes = Recipe.objects.order_by(*FEED_ORDERING)
+    return [
+        (
+            'Лента рецептов',
+            recipes[:PAGE_SIZE],
+            [Recipe], True,
+        ),
+        (
+            'Популярные рецепты',
+            Recipe.objects.order_by(*POPULAR_ORDERING)[:PAGE_SIZE],
+            [Recipe], True,
+        ),
+        (
+            'Рецепты автора',
+            recipes.filter(author=author)[:PAGE_SIZE],
+            [Recipe], True,
+        ),
+        (
+            'Фильтр по тегам',
+            recipes.filter(tags__slug__in=tags).distinct()[:PAGE_SIZE],
+            [Recipe.tags.through], False,
+        ),
+        (
+            'Фильтр избранного',
+            recipes.filter(favorite_recipe__user=user)[:PAGE_SIZE],
+            [Favorites], False,
+        ),
+        (
+            'Фильтр списка покупок',
+            recipes.filter(shopping_recipe__user=user)[:PAGE_SIZE],
+            [Shopping_cart], False,
+        ),
+        (
+            'Флаги рецептов',
+            Recipe.objects.with_user_flags(user).order_by(
+                *FEED_ORDERING
+            )[:PAGE_SIZE],
+            [Recipe, Favorites, Shopping_cart], True,
+        ),
+        (
+            'Подписки',
+            Subscriptions.objects.filter(user=user).order_by(
+                '-date_subscriptions'
+            )[:PAGE_SIZE],
+            [Subscriptions], True,
+        ),
+        (
+            'Лента подписок',
+            get_subscriptions(user)[:PAGE_SIZE],
+            [Subscriptions], False,
+        ),
+        (
+            'Список покупок',
+            get_shopping_list(user),
+            [Shopping_cart], False,
+        ),
+        (
+            'Похожие рецепты',
+            SimilarRecipe.objects.filter(recipe=recipes.first()).order_by(
+                '-score'
+            )[:PAGE_SIZE],
+            [SimilarRecipe], True,
+        ),
+    ]
+
+
+def disable_seq_scan():
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_bitmapscan = off')
+
+
+def get_plan_problems(plan, models, ordered):
+    tables = {model._meta.db_table for model in models}
+    problems = [
+        f'полный просмотр {table}'
+        for table in sorted(
+            set(SCAN_PATTERNS[connection.vendor].findall(plan)) & tables
+        )
+    ]
+    if ordered and SORT_PATTERNS[connection.vendor].search(plan):
+        problems.append('сортировка без индекса')
+    return problems
+
+
+class Command(BaseCommand):
+    help = (
+        'Проверяет планы ключевых запросов API: горячие таблицы должны '
+        'читаться по индексам, а ленты — без отдельной сортировки.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verbose-plans',
+            action='store_true',
+            help='Выводить полный план каждого запроса.',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor not in SCAN_PATTERNS:
+            raise CommandError(
+                f'СУБД {connection.vendor} не поддерживается.'
+            )
+        user = User.objects.filter(favorite_user__isnull=False).first()
+        author = Recipe.objects.values_list('author', flat=True).first()
+        tags = list(Tag.objects.values_list('slug', flat=True)[:2])
+        if user is None or author is None or not tags:
+            raise CommandError(
+                'Недостаточно данных: нужны рецепты, теги и пользователь '
+                'с избранным.'
+            )
+        failures = 0
+        with transaction.atomic():
+            disable_seq_scan()
+            for title, queryset, models, ordered in get_checks(
+                user, author, tags
+            ):
+                plan = queryset.explain()
+                problems = get_plan_problems(plan, models, ordered)
+                if problems:
+                    failures += 1
+                    self.stdout.write(self.style.ERROR(
+                        f'{title}: {", ".join(problems)}'
+                    ))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f'{title}: OK'))
+                if options['verbose_plans'] or problems:
+                    self.stdout.write(plan)
+        if failures:
+            raise CommandError(f'Регрессий в планах запросов: {failures}.')
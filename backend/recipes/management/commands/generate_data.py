@@ -0,0 +1,205 @@
+import random
+import time
+from io import BytesIO
+from uuid import uuid4
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from PIL import Image
+
+from api.cache import bump_version
+from api.images import save_variants
+from recipes.models import (Favorites, Ingredient, Recipe, RecipeIngredient,
+                            Shopping_cart, Tag)
+from users.models import Subscriptions, User
+
+BATCH_SIZE = 5000
+IMAGE_NAME = 'recipes/generated.png'
+PASSWORD = 'benchmark-password'
+
+
+def skewed(rng, items, skew):
+    return items[int(len(items) * rng.random() ** skew)]
+
+
+def get_new_ids(model, last_id):
+    return list(
+        model.objects.filter(pk__gt=last_id or 0)
+        .order_by('pk')
+        .values_list('pk', flat=True)
+    )
+
+
+def get_image():
+    if not default_storage.exists(IMAGE_NAME):
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 800), '#FCEB97').save(buffer, 'PNG')
+        default_storage.save(IMAGE_NAME, ContentFile(buffer.getvalue()))
+    return IMAGE_NAME, save_variants(IMAGE_NAME)
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерирует синтетические данные для нагрузочного тестирования: '
+        'пользователей, рецепты, избранное, списки покупок и подписки.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--favorites', type=int, default=100000)
+        parser.add_argument('--carts', type=int, default=10000)
+        parser.add_argument('--subscriptions', type=int, default=20000)
+        parser.add_argument(
+            '--ingredients-per-recipe',
+            type=int,
+            nargs=2,
+            default=(3, 12),
+            metavar=('MIN', 'MAX'),
+        )
+        parser.add_argument(
+            '--skew',
+            type=float,
+            default=3.0,
+            help=(
+                'Степень перекоса популярности авторов и рецептов: '
+                '1 — равномерно, чем больше, тем сильнее.'
+            ),
+        )
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.skew = options['skew']
+        if self.batch_size < 1 or self.skew < 1:
+            raise CommandError(
+                'Размер пакета и перекос должны быть не меньше 1.'
+            )
+        low, high = options['ingredients_per_recipe']
+        if not 0 < low <= high:
+            raise CommandError('Неверный диапазон числа ингредиентов.')
+        self.ingredients = list(
+            Ingredient.objects.values_list('pk', flat=True)
+        )
+        self.tags = list(Tag.objects.values_list('pk', flat=True))
+        if len(self.ingredients) < high or not self.tags:
+            raise CommandError(
+                'Сначала загрузите ингредиенты и теги: '
+                'python manage.py import run'
+            )
+        users = self.generate_users(options['users'])
+        if not users:
+            raise CommandError('Нужен хотя бы один пользователь.')
+        recipes = self.generate_recipes(options['recipes'], users, low, high)
+        self.generate_relations(
+            'Избранное', Favorites, 'recipe', options['favorites'],
+            users, recipes,
+        )
+        self.generate_relations(
+            'Списки покупок', Shopping_cart, 'recipe', options['carts'],
+            users, recipes,
+        )
+        self.generate_relations(
+            'Подписки', Subscriptions, 'author', options['subscriptions'],
+            users, users,
+        )
+        call_command('recount_recipes', stdout=self.stdout)
+        call_command('rebuild_search_index', stdout=self.stdout)
+        call_command('rebuild_timeline', stdout=self.stdout)
+        bump_version('recipes')
+
+    def report(self, title, count, started):
+        self.stdout.write(self.style.SUCCESS(
+            f'{title}: {count} за {time.perf_counter() - started:.1f} с.'
+        ))
+
+    def insert(self, model, objects):
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) == self.batch_size:
+                model.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        model.objects.bulk_create(batch, ignore_conflicts=True)
+
+    @transaction.atomic
+    def generate_users(self, count):
+        started = time.perf_counter()
+        last_id = User.objects.aggregate(last=Max('pk'))['last']
+        password = make_password(PASSWORD)
+        run = uuid4().hex[:8]
+        self.insert(User, (
+            User(
+                username=f'user_{run}_{index}',
+                email=f'user_{run}_{index}@example.com',
+                first_name=f'Имя {index}',
+                last_name=f'Фамилия {index}',
+                password=password,
+            )
+            for index in range(count)
+        ))
+        users = get_new_ids(User, last_id)
+        self.report('Пользователи', len(users), started)
+        return users or list(User.objects.values_list('pk', flat=True))
+
+    @transaction.atomic
+    def generate_recipes(self, count, users, low, high):
+        started = time.perf_counter()
+        last_id = Recipe.objects.aggregate(last=Max('pk'))['last']
+        image, variants = get_image()
+        self.insert(Recipe, (
+            Recipe(
+                author_id=skewed(self.rng, users, self.skew),
+                name=f'Рецепт {index}',
+                image=image,
+                image_variants=variants,
+                text=f'Описание рецепта {index}',
+                cooking_time=self.rng.randint(5, 180),
+            )
+            for index in range(count)
+        ))
+        recipes = get_new_ids(Recipe, last_id)
+        self.insert(RecipeIngredient, (
+            RecipeIngredient(
+                recipe_id=recipe,
+                ingredient_id=ingredient,
+                amount=self.rng.randint(1, 500),
+            )
+            for recipe in recipes
+            for ingredient in self.rng.sample(
+                self.ingredients, self.rng.randint(low, high)
+            )
+        ))
+        self.insert(Recipe.tags.through, (
+            Recipe.tags.through(recipe_id=recipe, tag_id=tag)
+            for recipe in recipes
+            for tag in self.rng.sample(
+                self.tags, self.rng.randint(1, len(self.tags))
+            )
+        ))
+        self.report('Рецепты', len(recipes), started)
+        return recipes or list(Recipe.objects.values_list('pk', flat=True))
+
+    @transaction.atomic
+    def generate_relations(self, title, model, field, count, users, targets):
+        started = time.perf_counter()
+        if not targets:
+            return
+        before = model.objects.count()
+        pairs = (
+            (self.rng.choice(users), skewed(self.rng, targets, self.skew))
+            for _ in range(count)
+        )
+        self.insert(model, (
+            model(user_id=user, **{f'{field}_id': target})
+            for user, target in pairs
+            if model is not Subscriptions or user != target
+        ))
+        self.report(title, model.objects.count() - before, started)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from api.images import generate_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создаёт WebP-превью для картинок рецептов.'
+
+    def handle(self, *args, **options):
+        generated = failed = 0
+        names = (
+            Recipe.objects.exclude(image='').order_by()
+            .values_list('image', flat=True)
+            .distinct()
+            .iterator()
+        )
+        for name in names:
+            try:
+                generate_variants(name)
+            except OSError as error:
+                failed += 1
+                self.stderr.write(f'{name}: {error}')
+            else:
+                generated += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Превью созданы для {generated} картинок, ошибок: {failed}.'
+        ))
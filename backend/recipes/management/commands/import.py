@@ -1,42 +1,175 @@
 import csv
+import json
+from itertools import islice
 from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
+from api.cache import bump_version
 from recipes.models import Ingredient, Tag
 
 COMMAND_TO_IMPORT = 'run'
 
-PATH = Path.cwd() / 'recipes' / 'data'
+PATH = Path(__file__).resolve().parents[2] / 'data'
 
+BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
 
-def add_ingredient(row):
-    ingredient = Ingredient(
-        name=row['name'],
-        measurement_unit=row['measurement_unit'],
+TAGS = [
+    {'name': 'Завтрак', 'color': '#FCEB97', 'slug': 'breakfast'},
+    {'name': 'Обед', 'color': '#6BB324', 'slug': 'lunch'},
+    {'name': 'Ужин', 'color': '#DC6C14', 'slug': 'dinner'},
+]
+
+
+def read_csv(file):
+    yield from csv.DictReader(file)
+
+
+def read_json(file):
+    decoder = json.JSONDecoder()
+    buffer = file.read(CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидается JSON-массив объектов.')
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip(' \t\r\n,')
+        if buffer.startswith(']'):
+            return
+        try:
+            row, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = file.read(CHUNK_SIZE)
+            if not chunk:
+                raise CommandError('Файл содержит некорректный JSON.')
+            buffer += chunk
+            continue
+        yield row
+        buffer = buffer[end:]
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def import_ingredients(rows, batch_size):
+    inserted = skipped = 0
+    for batch in batched(rows, batch_size):
+        try:
+            keys = {
+                (row['name'].strip(), row['measurement_unit'].strip())
+                for row in batch
+            }
+        except (KeyError, AttributeError, TypeError):
+            raise CommandError(
+                'Каждая запись должна содержать name и measurement_unit.'
+            )
+        existing = set(
+            Ingredient.objects
+            .filter(name__in={name for name, _ in keys})
+            .values_list('name', 'measurement_unit')
+        )
+        new = keys - existing
+        Ingredient.objects.bulk_create(
+            [
+                Ingredient(name=name, measurement_unit=measurement_unit)
+                for name, measurement_unit in new
+            ],
+            ignore_conflicts=True,
+        )
+        inserted += len(new)
+        skipped += len(batch) - len(new)
+    return inserted, skipped
+
+
+def import_tags(tags):
+    existing = Tag.objects.in_bulk(
+        [tag['slug'] for tag in tags], field_name='slug'
     )
-    ingredient.save()
+    new = []
+    changed = []
+    for data in tags:
+        tag = existing.get(data['slug'])
+        if tag is None:
+            new.append(Tag(**data))
+        elif (tag.name, tag.color) != (data['name'], data['color']):
+            tag.name = data['name']
+            tag.color = data['color']
+            changed.append(tag)
+    Tag.objects.bulk_create(new, ignore_conflicts=True)
+    Tag.objects.bulk_update(changed, ['name', 'color'])
+    return len(new), len(changed), len(tags) - len(new) - len(changed)
 
 
 class Command(BaseCommand):
+    help = 'Загружает ингредиенты из CSV/JSON и базовые теги.'
+
     def add_arguments(self, parser):
-        parser.add_argument(COMMAND_TO_IMPORT)
-
-    def handle(self, *args, **kwargs):
-        imported_models = {
-            'ingredients.csv': add_ingredient,
-        }
-
-        for key in imported_models.keys():
-            with open((f'{PATH}/{key}'), encoding='utf-8') as csvfile:
-                contents = csv.DictReader(csvfile)
-                for row in contents:
-                    imported_models[key](row)
-        self.stdout.write(self.style.SUCCESS('Игредиенты загружены успешно!'))
-
-        data = [
-            {'name': 'Завтрак', 'color': '#FCEB97', 'slug': 'breakfast'},
-            {'name': 'Обед', 'color': '#6BB324', 'slug': 'lunch'},
-            {'name': 'Ужин', 'color': '#DC6C14', 'slug': 'dinner'}]
-        Tag.objects.bulk_create(Tag(**tag) for tag in data)
-        self.stdout.write(self.style.SUCCESS('Тэги загружены!'))
+        parser.add_argument(COMMAND_TO_IMPORT, nargs='?')
+        parser.add_argument(
+            '--file',
+            default=str(PATH / 'ingredients.csv'),
+            help='Файл с ингредиентами (.csv или .json).',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Количество записей в одном INSERT.',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Посчитать изменения и откатить транзакцию.',
+        )
+        parser.add_argument(
+            '--skip-tags',
+            action='store_true',
+            help='Не загружать базовые теги.',
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options['file'])
+        reader = READERS.get(path.suffix.lower())
+        if reader is None:
+            raise CommandError('Поддерживаются только файлы .csv и .json.')
+        if options['batch_size'] < 1:
+            raise CommandError('Размер пакета должен быть больше 0.')
+        try:
+            with transaction.atomic():
+                with open(path, encoding='utf-8') as file:
+                    inserted, skipped = import_ingredients(
+                        reader(file), options['batch_size']
+                    )
+                if not options['skip_tags']:
+                    tags = import_tags(TAGS)
+                if options['dry_run']:
+                    transaction.set_rollback(True)
+                else:
+                    bump_version('ingredients')
+                    bump_version('tags')
+                    bump_version('recipes')
+        except OSError as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
+        prefix = 'Пробный запуск. ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}Ингредиенты: добавлено {inserted}, '
+            f'пропущено {skipped}.'
+        ))
+        if not options['skip_tags']:
+            self.stdout.write(self.style.SUCCESS(
+                f'{prefix}Теги: добавлено {tags[0]}, обновлено {tags[1]}, '
+                f'пропущено {tags[2]}.'
+            ))
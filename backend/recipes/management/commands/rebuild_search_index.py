@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.search import update_search_vectors
+from recipes.models import Recipe
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает полнотекстовый индекс рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Количество рецептов в одном UPDATE.',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('Размер пакета должен быть больше 0.')
+        ids = list(Recipe.objects.order_by('pk').values_list('pk', flat=True))
+        updated = 0
+        for start in range(0, len(ids), options['batch_size']):
+            batch = ids[start:start + options['batch_size']]
+            updated += update_search_vectors(
+                Recipe.objects.filter(pk__in=batch)
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Поисковый индекс обновлён для {updated} рецептов.'
+        ))
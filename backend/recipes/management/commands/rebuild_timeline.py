@@ -0,0 +1,56 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from api.cache import bump_version
+from api.services import backfill_timeline
+from recipes.models import TimelineEntry
+from users.models import Subscriptions, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Заново собирает ленты подписок: отмечает популярных авторов, '
+        'чьи рецепты подмешиваются при чтении, и заполняет ленты '
+        'остальных подписчиков.'
+    )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        popular = list(
+            Subscriptions.objects.order_by()
+            .values('author')
+            .annotate(followers=Count('pk'))
+            .filter(followers__gt=settings.TIMELINE_FANOUT_LIMIT)
+            .values_list('author', flat=True)
+        )
+        pushed = list(
+            User.objects.exclude(pk__in=popular).filter(timeline_pull=True)
+            .values_list('pk', flat=True)
+        )
+        pulled = list(
+            User.objects.filter(pk__in=popular, timeline_pull=False)
+            .values_list('pk', flat=True)
+        )
+        User.objects.filter(pk__in=pushed).update(timeline_pull=False)
+        User.objects.filter(pk__in=pulled).update(timeline_pull=True)
+        bump_version('timeline_pull')
+        TimelineEntry.objects.all().delete()
+        authors = {}
+        for user_id, author_id in (
+            Subscriptions.objects.order_by()
+            .values_list('user_id', 'author_id')
+        ):
+            authors.setdefault(user_id, []).append(author_id)
+        for user_id, author_ids in authors.items():
+            backfill_timeline(user_id, author_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Ленты собраны для {len(authors)} подписчиков, '
+            f'популярных авторов: {len(popular)}, '
+            f'записей: {TimelineEntry.objects.count()}, '
+            f'за {time.perf_counter() - started:.1f} с.'
+        ))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorites, Recipe, Shopping_cart
+
+
+def count_subquery(model):
+    return Coalesce(Subquery(
+        model.objects.filter(recipe=OuterRef('pk'))
+        .order_by()
+        .values('recipe')
+        .annotate(total=Count('id'))
+        .values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики избранного и списков покупок.'
+
+    def handle(self, *args, **options):
+        updated = Recipe.objects.update(
+            favorites_count=count_subquery(Favorites),
+            cart_count=count_subquery(Shopping_cart),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Счётчики пересчитаны для {updated} рецептов.'
+        ))
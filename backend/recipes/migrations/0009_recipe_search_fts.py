@@ -0,0 +1,45 @@
+from django.db import migrations
+
+FTS_TABLE = 'recipes_recipe_fts'
+
+
+def fold(column):
+    return f"REPLACE(REPLACE({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def create_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+        f'USING fts5(name, ingredients, text, tokenize=unicode61)'
+    )
+    schema_editor.execute(
+        f'INSERT INTO {FTS_TABLE} (rowid, name, ingredients, text) '
+        f'SELECT recipe.id, {fold("recipe.name")}, '
+        f"{fold('GROUP_CONCAT(ingredient.name, %s)')}, "
+        f'{fold("recipe.text")} '
+        f'FROM recipes_recipe recipe '
+        f'LEFT JOIN recipes_recipeingredient item '
+        f'ON item.recipe_id = recipe.id '
+        f'LEFT JOIN recipes_ingredient ingredient '
+        f'ON ingredient.id = item.ingredient_id '
+        f'GROUP BY recipe.id',
+        [' '],
+    )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -1,7 +1,9 @@
 from colorfield.fields import ColorField
+from django.contrib.postgres.search import SearchVectorField
 from django.core import validators
 from django.core.validators import MinValueValidator, RegexValidator
 from django.db import models
+from django.db.models import Exists, OuterRef, Value
 
 from users.models import User
 
@@ -66,6 +68,26 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.measurement_unit}'
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    def with_user_flags(self, user):
+        if user.is_anonymous:
+            return self.annotate(
+                is_favorited=Value(False, output_field=models.BooleanField()),
+                is_in_shopping_cart=Value(
+                    False, output_field=models.BooleanField()
+                ),
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                Favorites.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                Shopping_cart.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+        )
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(User,
                                on_delete=models.CASCADE,
@@ -102,11 +124,52 @@ class Recipe(models.Model):
         verbose_name='Дата публикации рецепта',
         auto_now_add=True
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False,
+    )
+    cart_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False,
+    )
+    image_variants = models.JSONField(
+        verbose_name='Превью картинки',
+        default=dict,
+        editable=False,
+    )
+    search_vector = SearchVectorField(null=True, editable=False)
+    similar_stale = models.BooleanField(
+        verbose_name='Нужно пересчитать похожие рецепты',
+        default=True,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
-        ordering = ['-pub_date']
+        ordering = ['-pub_date', '-id']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'], name='recipe_pub_date_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=['-favorites_count', '-pub_date', '-id'],
+                name='recipe_popular_idx'
+            ),
+            models.Index(
+                fields=['id'],
+                condition=models.Q(similar_stale=True),
+                name='recipe_similar_stale_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -164,7 +227,6 @@ class Favorites(models.Model):
                              )
 
     class Meta:
-        ordering = ['user']
         verbose_name = 'Рецепт в Избранном'
         verbose_name_plural = 'Рецепты в Избранном'
         constraints = [
@@ -173,6 +235,11 @@ class Favorites(models.Model):
                 name='unique_favorite'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['user', 'recipe'], name='favorite_user_recipe_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'Рецепт {self.recipe.name} в избранном у {self.user}'
@@ -193,7 +260,6 @@ class Shopping_cart(models.Model):
                                verbose_name='Рецепт')
 
     class Meta:
-        ordering = ['user']
         verbose_name = 'Корзина'
         verbose_name_plural = 'Корзины покупок пользователей'
         constraints = [
@@ -204,3 +270,66 @@ class Shopping_cart(models.Model):
 
     def __str__(self):
         return f'{self.user.username} - {self.recipe.name}'
+
+
+class SimilarRecipe(models.Model):
+    recipe = models.ForeignKey(Recipe,
+                               on_delete=models.CASCADE,
+                               related_name='similar_recipes',
+                               verbose_name='Рецепт'
+                               )
+    similar = models.ForeignKey(Recipe,
+                                on_delete=models.CASCADE,
+                                related_name='+',
+                                verbose_name='Похожий рецепт'
+                                )
+    score = models.FloatField(verbose_name='Сходство')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'similar'], name='unique_similar_recipe'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['recipe', '-score'], name='similar_recipe_score_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe_id} → {self.similar_id}: {self.score:.3f}'
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='timeline',
+                             verbose_name='Подписчик'
+                             )
+    recipe = models.ForeignKey(Recipe,
+                               on_delete=models.CASCADE,
+                               related_name='+',
+                               verbose_name='Рецепт'
+                               )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации рецепта')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'], name='unique_timeline_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='timeline_user_pub_date_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id}: {self.recipe_id}'
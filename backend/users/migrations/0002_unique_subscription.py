@@ -0,0 +1,30 @@
+# Generated by Django 3.2 on 2026-10-18 03:40
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+
+
+def remove_duplicates(apps, schema_editor):
+    Subscriptions = apps.get_model('users', 'Subscriptions')
+    first = Subscriptions.objects.filter(
+        user=OuterRef('user'), author=OuterRef('author')
+    ).order_by('date_subscriptions', 'id').values('id')[:1]
+    duplicates = Subscriptions.objects.annotate(
+        first_id=Subquery(first)
+    ).exclude(id=F('first_id')).values_list('id', flat=True)
+    Subscriptions.objects.filter(id__in=list(duplicates)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='subscriptions',
+            constraint=models.UniqueConstraint(fields=('user', 'author'), name='unique_subscription'),
+        ),
+    ]
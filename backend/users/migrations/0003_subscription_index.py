@@ -0,0 +1,17 @@
+# Generated by Django 3.2 on 2026-10-18 03:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_unique_subscription'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subscriptions',
+            index=models.Index(fields=['user', '-date_subscriptions'], name='subscription_user_date_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-18 03:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_subscription_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='timeline_pull',
+            field=models.BooleanField(default=False, editable=False, verbose_name='лента подписчиков собирается при чтении'),
+        ),
+    ]
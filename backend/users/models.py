@@ -1,11 +1,29 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.core.validators import RegexValidator
 from django.db import models
 
+from .signals import users_updated
+
 LEN_EMAIL = 254
 LEN_STRING = 150
 
 
+class UserQuerySet(models.QuerySet):
+
+    def update(self, **kwargs):
+        user_ids = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        if user_ids:
+            users_updated.send(
+                sender=self.model, user_ids=user_ids, fields=set(kwargs)
+            )
+        return rows
+
+
+class CustomUserManager(UserManager.from_queryset(UserQuerySet)):
+    pass
+
+
 class User(AbstractUser):
     email = models.EmailField(max_length=LEN_EMAIL, unique=True)
     username = models.CharField(
@@ -24,6 +42,13 @@ class User(AbstractUser):
     last_name = models.CharField(
         'фамилия', max_length=LEN_STRING
     )
+    timeline_pull = models.BooleanField(
+        'лента подписчиков собирается при чтении',
+        default=False,
+        editable=False,
+    )
+
+    objects = CustomUserManager()
 
     class Meta:
         ordering = ['id']
@@ -55,6 +80,18 @@ class Subscriptions(models.Model):
         ordering = ['-date_subscriptions']
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки пользователей'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'author'],
+                name='unique_subscription'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-date_subscriptions'],
+                name='subscription_user_date_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.user.username} - {self.author.username}'